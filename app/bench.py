@@ -0,0 +1,248 @@
+"""Offline benchmark for _fetch_balance against a local stand-in dashboard.
+
+    python bench.py --runs 10 --delay-ms 150 --size-kb 200 --headless
+
+Each run is a fresh child process (cold launch, like a scheduled run) pointed at
+the stand-in via DASHBOARD_URL. Results are appended to bench_results.jsonl keyed
+by the blob SHA of main.py, so two versions can be compared before rollout.
+
+Runs share one profile, so the stand-in's cacheable script and images are served
+from the HTTP cache after the first run. Request routing disables that cache;
+compare both before turning ROUTE_BLOCK on:
+
+    python bench.py --runs 10 --headless
+    python bench.py --runs 10 --headless --route-block
+"""
+import argparse, asyncio, hashlib, json, math, os, subprocess, sys, tempfile, threading, time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+try:
+    import psutil
+except ImportError:        # optional; falls back to wait4 rusage (Unix only)
+    psutil = None
+
+HERE = Path(__file__).resolve().parent
+MAIN = HERE / "main.py"
+RESULTS = os.getenv("BENCH_RESULTS", "bench_results.jsonl")
+
+MAIN_SEL = os.getenv("BALANCE_SELECTOR_MAIN", ".ps-digits-1.balance-amount")
+DEC_SEL  = os.getenv("BALANCE_SELECTOR_DEC", ".ps-digits-2")
+CUR_SEL  = os.getenv("CURRENCY_SELECTOR", ".balance-currency")
+
+def _classes(sel: str) -> str:
+    """'.a.b' -> 'a b'. The stand-in only reproduces plain class selectors."""
+    parts = sel.strip().split(".")
+    if parts[0] or not all(parts[1:]):
+        raise SystemExit(f"[bench] can only stand in for class selectors, got {sel!r}")
+    return " ".join(parts[1:])
+
+def _wallets(cfg):
+    return [(1234 + i, 56 + i % 40, ("USD", "EUR", "GBP")[i % 3]) for i in range(cfg.wallets)]
+
+def _dashboard_html(cfg):
+    """Returns (dashboard page, /api/wallets payload: structured wallets plus their markup)."""
+    markup = "".join(
+        f'<div class="wallet"><span class="{_classes(MAIN_SEL)}">{whole:,}</span>'
+        f'<span class="{_classes(DEC_SEL)}">.{dec}</span>'
+        f'<span class="{_classes(CUR_SEL)}">{cur}</span></div>'
+        for whole, dec, cur in _wallets(cfg)
+    )
+    api = json.dumps({
+        "wallets": [{"balance": f"{whole}.{dec}", "currency": cur} for whole, dec, cur in _wallets(cfg)],
+        "html": markup,
+    })
+    assets = "".join(f'<img src="/asset/{i}.png" width="1" height="1">' for i in range(cfg.assets))
+    assets += '<script src="/static/app.js"></script>' if cfg.script_kb else ""
+    padding = "<!--" + "x" * (cfg.size_kb * 1024) + "-->"
+    return f"""<!doctype html><html><head><title>Dashboard</title></head><body>
+<div id="onetrust-banner-sdk" style="position:fixed;bottom:0;left:0;right:0;background:#eee">
+  <button id="onetrust-accept-btn-handler">Accept All</button>
+  <button id="onetrust-reject-all-handler">Reject All</button>
+</div>
+<div id="app"></div>{assets}{padding}
+<script>
+  for (const id of ["onetrust-accept-btn-handler", "onetrust-reject-all-handler"])
+    document.getElementById(id).onclick = () => document.getElementById("onetrust-banner-sdk").remove();
+  fetch("/api/wallets").then(r => r.json()).then(d => {{
+    setTimeout(() => {{ document.getElementById("app").innerHTML = d.html; }}, {cfg.render_ms});
+  }});
+</script></body></html>""".encode("utf-8"), api.encode("utf-8")
+
+def _serve(cfg):
+    page, api = _dashboard_html(cfg)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *a):
+            pass
+
+        def _send(self, body, ctype, cache=False):
+            time.sleep(cfg.delay_ms / 1000)
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Cache-Control", "max-age=86400" if cache else "no-store")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith("/api/wallets"):
+                self._send(api, "application/json")
+            elif self.path.startswith("/asset/"):
+                self._send(b"\0" * (cfg.asset_kb * 1024), "image/png", cache=True)
+            elif self.path.startswith("/static/"):
+                self._send(b"//" + b"x" * (cfg.script_kb * 1024) + b"\n", "application/javascript", cache=True)
+            else:
+                self._send(page, "text/html; charset=utf-8")
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+def _child():
+    """One measured run inside a fresh interpreter; prints a JSON line for the parent."""
+    sys.path.insert(0, str(HERE))
+    import main
+    t0 = time.perf_counter()
+    wallets = asyncio.run(main._fetch_balance())
+    print(json.dumps({"latency": time.perf_counter() - t0,
+                      "wallets": [[str(a), c] for a, c in wallets]}))
+
+def _tree_sample(proc):
+    """(rss bytes, cpu seconds) summed over proc and its descendants."""
+    rss = cpu = 0
+    for p in [proc] + proc.children(recursive=True):
+        try:
+            rss += p.memory_info().rss
+            t = p.cpu_times()
+            cpu += t.user + t.system
+        except psutil.Error:
+            pass
+    return rss, cpu
+
+def _one_run(env):
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, str(Path(__file__).resolve()), "--child"],
+                            env=env, stdout=subprocess.PIPE, text=True)
+    peak = cpu = 0
+    if psutil:
+        ps = psutil.Process(proc.pid)
+        while proc.poll() is None:
+            try:
+                rss, c = _tree_sample(ps)
+                peak, cpu = max(peak, rss), max(cpu, c)
+            except psutil.Error:
+                break
+            time.sleep(0.05)
+        out = proc.stdout.read()
+        proc.wait()
+    else:
+        out = proc.stdout.read()
+        _, status, ru = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is KiB on Linux: the largest single process, not the whole tree
+        peak, cpu = ru.ru_maxrss * 1024, ru.ru_utime + ru.ru_stime
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0 or not out.strip():
+        return None
+    res = json.loads(out.strip().splitlines()[-1])
+    res.update(wall=wall, peak_rss=peak, cpu=cpu)
+    return res
+
+def _pct(values, q):
+    """Nearest-rank percentile."""
+    v = sorted(values)
+    return v[max(0, math.ceil(q / 100 * len(v)) - 1)]
+
+def _version() -> str:
+    data = MAIN.read_bytes()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def _compare(rec, max_regress) -> bool:
+    """Compare with the previous result for the same config; False on a p95 regression."""
+    prev = None
+    try:
+        with open(RESULTS, encoding="utf-8") as f:
+            for line in f:
+                r = json.loads(line)
+                if r["config"] == rec["config"] and r["version"] != rec["version"]:
+                    prev = r
+    except FileNotFoundError:
+        pass
+    if prev is None:
+        print("[bench] no earlier version with this config to compare against")
+        return True
+    ok = True
+    for k in ("p50", "p95", "peak_rss_mb", "cpu_s"):
+        a, b = prev[k], rec[k]
+        change = (b - a) / a if a else 0.0
+        flag = ""
+        if k == "p95" and change > max_regress:
+            flag, ok = "  <-- REGRESSION", False
+        print(f"[bench] {k:12s} {a:10.3f} -> {b:10.3f} ({change:+.1%}){flag}")
+    return ok
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--delay-ms", type=int, default=100, help="server delay per response")
+    ap.add_argument("--render-ms", type=int, default=300, help="client-side delay before balance renders")
+    ap.add_argument("--size-kb", type=int, default=100, help="dashboard HTML padding")
+    ap.add_argument("--assets", type=int, default=10, help="images referenced by the dashboard")
+    ap.add_argument("--asset-kb", type=int, default=50)
+    ap.add_argument("--script-kb", type=int, default=300, help="cacheable script loaded by the dashboard; 0 = none")
+    ap.add_argument("--wallets", type=int, default=1)
+    ap.add_argument("--headless", action="store_true")
+    ap.add_argument("--source", choices=("dom", "api"), default="dom", help="BALANCE_SOURCE for main.py")
+    ap.add_argument("--route-block", action="store_true", help="ROUTE_BLOCK=1 (routing disables the HTTP cache)")
+    ap.add_argument("--max-regress", type=float, default=0.2, help="allowed p95 increase vs previous version")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    cfg = ap.parse_args()
+    if cfg.child:
+        return _child()
+
+    srv = _serve(cfg)
+    with tempfile.TemporaryDirectory(prefix="bench-profile-") as profile:
+        env = dict(os.environ,
+                   DASHBOARD_URL=f"http://127.0.0.1:{srv.server_address[1]}/wallet/ng/dashboard",
+                   USER_DATA_DIR=profile, METRICS_LOG="", METRICS_PROM="",
+                   PW_HEADLESS="1" if cfg.headless else os.getenv("PW_HEADLESS", "0"),
+                   BALANCE_SOURCE=cfg.source, BALANCE_API_URLS="*/api/wallets*",
+                   ROUTE_BLOCK="1" if cfg.route_block else "0")
+        runs = []
+        for i in range(cfg.runs):
+            r = _one_run(env)
+            if r is None:
+                print(f"[bench] run {i + 1}/{cfg.runs} failed")
+                continue
+            print(f"[bench] run {i + 1}/{cfg.runs}: {r['latency']:.2f}s fetch, {r['wall']:.2f}s wall, "
+                  f"{r['peak_rss'] / 1048576:.0f} MiB peak, {r['cpu']:.2f}s cpu")
+            runs.append(r)
+    srv.shutdown()
+    if not runs:
+        print("[bench] every run failed")
+        return 1
+
+    lat = [r["latency"] for r in runs]
+    config = {k: v for k, v in vars(cfg).items() if k not in ("runs", "child", "max_regress")}
+    rec = {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "version": _version(),
+        "config": config,
+        "runs": len(runs),
+        "failed": cfg.runs - len(runs),
+        "p50": _pct(lat, 50),
+        "p95": _pct(lat, 95),
+        "peak_rss_mb": max(r["peak_rss"] for r in runs) / 1048576,
+        "cpu_s": sum(r["cpu"] for r in runs) / len(runs),
+    }
+    print(f"[bench] p50 {rec['p50']:.2f}s  p95 {rec['p95']:.2f}s  "
+          f"peak {rec['peak_rss_mb']:.0f} MiB  cpu {rec['cpu_s']:.2f}s/run")
+    ok = _compare(rec, cfg.max_regress)
+    with open(RESULTS, "a", encoding="utf-8") as f:
+        f.write(json.dumps(rec) + "\n")
+    return 0 if ok else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,143 @@
-import subprocess, sys, os, asyncio, re, tempfile, shutil, random, math, time
-import hashlib
+import time
+_T_START = time.perf_counter()
+import subprocess, sys, os, re, tempfile, shutil, random, math
+import argparse, hashlib, importlib
+from fnmatch import fnmatch
 from pathlib import Path
-from datetime import datetime
-import requests
+from datetime import datetime, timezone
 import json
+import struct
+from collections import namedtuple, deque
+from decimal import Decimal, InvalidOperation
+import sqlite3
+from contextlib import closing, contextmanager
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright, TimeoutError as PwTimeout
-import assemblyai as aai
+# requests, playwright and assemblyai are imported on first use via _import(),
+# so cheap subcommands (status, push) never pay for them
+
+class _LazyModule:
+    """Module stand-in that imports the real module on first attribute access."""
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(_import(self._name), attr)
+
+asyncio = _LazyModule("asyncio")   # ~50 ms on small VPS boxes; only the browser paths need it
 
 load_dotenv()
 
 WEBAPP_URL   = os.getenv("WEBAPP_URL", "")
 WEBAPP_TOKEN = os.getenv("WEBAPP_TOKEN", "")
+WEBAPP_BATCH = os.getenv("WEBAPP_BATCH", "0") == "1"   # web app accepts a JSON array per POST
+
+# Optional fleet collector (`main.py collect`): clients post to COLLECTOR_URL instead of
+# WEBAPP_URL, and the collector forwards the newest reading per VPS once per interval:
+# as one batched write with WEBAPP_BATCH=1, otherwise one POST per VPS
+COLLECTOR_URL      = os.getenv("COLLECTOR_URL", "")
+COLLECTOR_TOKEN    = os.getenv("COLLECTOR_TOKEN", "")
+COLLECTOR_BIND     = os.getenv("COLLECTOR_BIND", "127.0.0.1")
+COLLECTOR_PORT     = int(os.getenv("COLLECTOR_PORT", "8787"))
+COLLECTOR_INTERVAL = float(os.getenv("COLLECTOR_INTERVAL", "60"))
+COLLECTOR_STATE    = os.getenv("COLLECTOR_STATE", "collector_pending.json")   # stored next to your working dir
+
+USER_DATA_DIR = os.getenv("USER_DATA_DIR", "/app/user-data")
+# Durable state lives next to the browser profile, not in the working directory: the
+# launchers start from different directories, and the setup script replaces the app
+# directory wholesale. Relative state paths below are taken inside STATE_DIR.
+STATE_DIR = Path(os.getenv("STATE_DIR") or Path(USER_DATA_DIR).resolve().parent / "state")
+
+def _state_path(env: str, default: str) -> str:
+    return str(STATE_DIR / os.getenv(env, default))
+
+OUTBOX_DB           = _state_path("OUTBOX_DB", "outbox.sqlite3")
+OUTBOX_BATCH_SIZE   = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "30"))
+OUTBOX_BACKOFF_MAX  = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+
+HISTORY_FILE   = _state_path("HISTORY_FILE", "balance_history.bin")
+PUSH_MODE      = os.getenv("PUSH_MODE", "always")                    # always | changed
+PUSH_HEARTBEAT = float(os.getenv("PUSH_HEARTBEAT", "21600"))         # seconds; PUSH_MODE=changed only
 
 NETELLER_EMAIL = os.getenv("NETELLER_EMAIL", "")
 NETELLER_PASS  = os.getenv("NETELLER_PASS", "")
 
 DASHBOARD_URL = os.getenv("DASHBOARD_URL", "https://member.neteller.com/wallet/ng/dashboard")
 CHROME_PROFILE_PATH = os.getenv("CHROME_PROFILE_PATH")
-USER_DATA_DIR = os.getenv("USER_DATA_DIR", "/app/user-data")
+PW_HEADLESS   = os.getenv("PW_HEADLESS", "0") == "1"
+
+# Browser launch profile. "lowres" targets 1 GB VPS boxes: headless, small fixed
+# viewport, one renderer process, capped JS heap and an RSS ceiling.
+BROWSER_PROFILE    = os.getenv("BROWSER_PROFILE", "default")     # default | lowres
+BROWSER_DISPLAY    = os.getenv("BROWSER_DISPLAY", "")            # headed | headless | xvfb; "" = profile default
+BROWSER_VIEWPORT   = os.getenv("BROWSER_VIEWPORT", "1280x800")   # used by lowres and xvfb
+BROWSER_MEM_MB     = int(os.getenv("BROWSER_MEM_MB", "600" if BROWSER_PROFILE == "lowres" else "0"))  # 0 = no ceiling
+BROWSER_EXTRA_ARGS = os.getenv("BROWSER_EXTRA_ARGS", "")         # whitespace-separated extra flags
 
 BALANCE_SELECTOR_MAIN = os.getenv("BALANCE_SELECTOR_MAIN", ".ps-digits-1.balance-amount")
 BALANCE_SELECTOR_DEC  = os.getenv("BALANCE_SELECTOR_DEC", ".ps-digits-2")
 CURRENCY_SELECTOR     = os.getenv("CURRENCY_SELECTOR", ".balance-currency")
 
-SYNC_MARKER = Path(USER_DATA_DIR) / ".host_profile_synced"
+LOGIN_EMAIL_SEL   = 'input[id^="user_authentication_email"]'
+COOKIE_BANNER_SEL = '#onetrust-reject-all-handler, #onetrust-accept-btn-handler'
+CAPTCHA_FRAME_SEL = 'iframe[src*="recaptcha"], iframe[src*="hcaptcha.com"]'
+
+RUN_BUDGET = float(os.getenv("RUN_BUDGET", "180"))   # seconds for login + extraction, all waits included
+
+def _csv(value: str):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+# BALANCE_SOURCE=api reads the balance from the JSON the dashboard fetches to render
+# wallets, falling back to the DOM if no matching payload shows up. Keep the URL
+# patterns to the balances endpoint itself: any other matching JSON with amount and
+# currency keys (limits, fees) would be taken as the balance.
+BALANCE_SOURCE        = os.getenv("BALANCE_SOURCE", "dom")   # dom | api
+BALANCE_API_URLS      = _csv(os.getenv("BALANCE_API_URLS", "*/api/*/balances,*/api/*/balances[?]*"))
+BALANCE_AMOUNT_KEYS   = _csv(os.getenv("BALANCE_AMOUNT_KEYS", "availableBalance,balance"))
+BALANCE_CURRENCY_KEYS = _csv(os.getenv("BALANCE_CURRENCY_KEYS", "currency,currencyCode"))
+AMOUNT_DECIMAL_SEP    = os.getenv("AMOUNT_DECIMAL_SEP", "")   # "." or ","; empty = infer per amount
+
+# Transaction export: pages through the activity JSON (newest first) with the logged-in
+# context until it reaches the stored cursor. TX_API_URL takes {page} and {size}.
+TX_API_URL     = os.getenv("TX_API_URL", "")                 # "" disables the export
+TX_PAGE_SIZE   = int(os.getenv("TX_PAGE_SIZE", "50"))
+TX_FIRST_PAGE  = int(os.getenv("TX_FIRST_PAGE", "1"))
+TX_MAX_PAGES   = int(os.getenv("TX_MAX_PAGES", "40"))        # per run; a longer backfill resumes next run
+TX_ID_KEYS     = _csv(os.getenv("TX_ID_KEYS", "transactionId,id,reference"))
+TX_TIME_KEYS   = _csv(os.getenv("TX_TIME_KEYS", "transactionDate,createdAt,date,timestamp"))
+TX_AMOUNT_KEYS = _csv(os.getenv("TX_AMOUNT_KEYS", "amount,value"))
+TX_TEXT_KEYS   = _csv(os.getenv("TX_TEXT_KEYS", "description,type,merchant"))
+TX_FILE        = _state_path("TX_FILE", "transactions.jsonl")  # append-only; each run's rows oldest first
+TX_CURSOR      = _state_path("TX_CURSOR", ".tx_cursor.json")  # a lost cursor means a full re-export
+TX_PUSH_URL    = os.getenv("TX_PUSH_URL", "")                # takes JSON arrays of rows; "" = local file only
+TX_PUSH_TOKEN  = os.getenv("TX_PUSH_TOKEN", "")              # optional bearer token for TX_PUSH_URL
+
+# Request routing: drop what the balance flow never needs. Allow wins over block.
+# Off by default: while a route is installed Chromium bypasses its HTTP cache and every
+# request makes a round trip through Python, which can cost more than the blocked bytes
+# save on a warm profile. Compare with `bench.py --route-block` before enabling.
+ROUTE_BLOCK       = os.getenv("ROUTE_BLOCK", "0") == "1"
+ROUTE_BLOCK_TYPES = set(_csv(os.getenv("ROUTE_BLOCK_TYPES", "image,font,media")))
+ROUTE_BLOCK_URLS  = _csv(os.getenv("ROUTE_BLOCK_URLS",
+    "*google-analytics.com/*,*googletagmanager.com/*,*doubleclick.net/*,*hotjar.com/*,"
+    "*facebook.net/*,*connect.facebook.com/*,*bing.com/*,*clarity.ms/*,*newrelic.com/*,"
+    "*nr-data.net/*,*segment.io/*,*optimizely.com/*,*quantummetric.com/*"))
+ROUTE_ALLOW_URLS  = _csv(os.getenv("ROUTE_ALLOW_URLS",
+    "*recaptcha*,*gstatic.com/recaptcha/*,*hcaptcha.com/*,*cookielaw.org/*,*onetrust.com/*"))
+
+DAEMON_INTERVAL     = float(os.getenv("DAEMON_INTERVAL", "0"))   # seconds; 0 = one-shot run
+DAEMON_MAX_FAILURES = int(os.getenv("DAEMON_MAX_FAILURES", "3"))
+DAEMON_UPDATE_EVERY = int(os.getenv("DAEMON_UPDATE_EVERY", "12"))   # ticks between update checks; 0 = never
+
+SYNC_MANIFEST = Path(USER_DATA_DIR) / ".host_profile_manifest.json"
+FETCH_LOCK    = Path(USER_DATA_DIR) / ".fetch.lock"          # one browser per profile, host-wide
+FETCH_RESULT  = Path(USER_DATA_DIR) / ".last_fetch.json"
+RESULT_TTL    = float(os.getenv("RESULT_TTL", "300"))        # seconds a fetched balance is reused; 0 = never
+FETCH_LOCK_WAIT = float(os.getenv("FETCH_LOCK_WAIT", str(RUN_BUDGET + 120)))
+SYNC_WORKERS  = int(os.getenv("SYNC_WORKERS", "4"))
+
+PROFILE_BUDGET_MB          = float(os.getenv("PROFILE_BUDGET_MB", "0"))   # 0 = no budget
+PROFILE_MAINTAIN_ON_LAUNCH = os.getenv("PROFILE_MAINTAIN_ON_LAUNCH", "0") == "1"
 
 VPS = os.getenv("VPS")
 
@@ -37,6 +150,99 @@ GIT_BRANCH   = "main"
 REMOTE_PATH  = "app/main.py"            # path to this very file in the repo
 SHA_CACHE    = ".last_remote_sha"       # stored next to your working dir
 
+METRICS_LOG  = os.getenv("METRICS_LOG", "run_metrics.jsonl")       # "" disables
+METRICS_PROM = os.getenv("METRICS_PROM", "auto_accounting.prom")   # node_exporter textfile; "" disables
+
+TRACE_DIR       = os.getenv("TRACE_DIR", "traces")                   # failure traces; "" disables
+TRACE_BUDGET_MB = float(os.getenv("TRACE_BUDGET_MB", "50"))          # oldest traces are evicted past this
+TRACE_EVENTS    = int(os.getenv("TRACE_EVENTS", "300"))              # page events kept in memory
+
+# --- Run metrics: per-phase spans and counters, exported once per run ---
+_metrics = {"spans": {}, "counters": {}, "gauges": {}}
+
+@contextmanager
+def span(name: str):
+    """Time one phase; repeated phases accumulate total seconds and a call count."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        total, calls = _metrics["spans"].get(name, (0.0, 0))
+        _metrics["spans"][name] = (total + dt, calls + 1)
+
+def count(name: str, n: int = 1):
+    _metrics["counters"][name] = _metrics["counters"].get(name, 0) + n
+
+def gauge_max(name: str, value: float):
+    """Keep the highest value seen this run (peak RSS and the like)."""
+    _metrics["gauges"][name] = max(value, _metrics["gauges"].get(name, value))
+
+def _reset_metrics():
+    _metrics["spans"].clear()
+    _metrics["counters"].clear()
+    _metrics["gauges"].clear()
+
+def write_metrics(ok: bool):
+    """Append this run to METRICS_LOG (JSONL) and rewrite the METRICS_PROM textfile."""
+    now = time.time()
+    spans = {k: round(v[0], 4) for k, v in _metrics["spans"].items()}
+    rec = {"ts": datetime.now().isoformat(timespec="seconds"), "vps": VPS, "ok": ok,
+           "spans": spans, "counters": dict(_metrics["counters"]), "gauges": dict(_metrics["gauges"])}
+    try:
+        if METRICS_LOG:
+            with open(METRICS_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, separators=(",", ":")) + "\n")
+        if METRICS_PROM:
+            vps = (VPS or "").replace("\\", "").replace('"', "")
+            lines = [
+                "# TYPE auto_accounting_phase_seconds gauge",
+                *(f'auto_accounting_phase_seconds{{phase="{k}",vps="{vps}"}} {v}' for k, v in spans.items()),
+                "# TYPE auto_accounting_events gauge",
+                *(f'auto_accounting_events{{event="{k}",vps="{vps}"}} {v}' for k, v in rec["counters"].items()),
+                "# TYPE auto_accounting_resource gauge",
+                *(f'auto_accounting_resource{{kind="{k}",vps="{vps}"}} {v}' for k, v in rec["gauges"].items()),
+                "# TYPE auto_accounting_last_run_success gauge",
+                f'auto_accounting_last_run_success{{vps="{vps}"}} {int(ok)}',
+                "# TYPE auto_accounting_last_run_timestamp_seconds gauge",
+                f'auto_accounting_last_run_timestamp_seconds{{vps="{vps}"}} {now:.0f}',
+            ]
+            # Write-then-rename so the node_exporter textfile collector never reads a partial file
+            d = os.path.dirname(os.path.abspath(METRICS_PROM))
+            fd, tmp = tempfile.mkstemp(dir=d, prefix=".metrics_", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp, METRICS_PROM)
+    except OSError as e:
+        print(f"[metrics] write failed: {e}")
+
+def _import(name: str):
+    """Import a heavy dependency on first use; the cost shows up as an import:<name> span."""
+    mod = sys.modules.get(name)
+    if mod is None:
+        with span(f"import:{name}"):
+            mod = importlib.import_module(name)
+    return mod
+
+def _import_report():
+    print(f"[startup] main.py loaded in {_MODULE_LOAD_S * 1000:.1f} ms")
+    for name, (secs, _) in _metrics["spans"].items():
+        if name.startswith("import:"):
+            print(f"[startup] {name:32s} {secs * 1000:8.1f} ms")
+
+_http = None
+
+def _session():
+    """One pooled keep-alive session shared by every HTTP call in this process."""
+    global _http
+    if _http is None:
+        requests = _import("requests")
+        _http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        _http.mount("https://", adapter)
+        _http.mount("http://", adapter)
+    return _http
+
 def _gh_headers():
     h = {}
     tok = os.getenv("GITHUB_TOKEN")
@@ -45,13 +251,50 @@ def _gh_headers():
     h["Accept"] = "application/vnd.github+json"
     return h
 
-def _fetch_remote_meta():
+def _read_update_cache():
+    """SHA_CACHE holds the last seen blob SHA and, on a second line, its ETag."""
+    try:
+        lines = open(SHA_CACHE, "r", encoding="utf-8").read().splitlines()
+    except Exception:
+        return None, None
+    sha = lines[0].strip() if lines else None
+    etag = lines[1].strip() if len(lines) > 1 else None
+    return sha or None, etag or None
+
+def _write_update_cache(sha, etag):
+    with open(SHA_CACHE, "w", encoding="utf-8") as f:
+        f.write(sha + "\n" + (etag or "") + "\n")
+
+def _fetch_remote_meta(etag=None):
+    """Returns (sha, download_url, size, etag), or None if unchanged since etag."""
     url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{REMOTE_PATH}?ref={GIT_BRANCH}"
-    r = requests.get(url, headers=_gh_headers(), timeout=10)
+    headers = _gh_headers()
+    if etag:
+        headers["If-None-Match"] = etag
+    r = _session().get(url, headers=headers, timeout=10)
+    if r.status_code == 304:
+        return None
     r.raise_for_status()
     data = r.json()
     # data["sha"] is the blob SHA (good stable version token), data["download_url"] is raw file
-    return data["sha"], data["download_url"]
+    return data["sha"], data["download_url"], data["size"], r.headers.get("ETag")
+
+def _git_blob_sha(data: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def _download_verified(raw_url: str, size: int, expected_sha: str) -> bytes:
+    """Stream the raw file, hashing as it arrives; raise unless it matches the blob SHA."""
+    h = hashlib.sha1(b"blob %d\0" % size)
+    chunks = []
+    with _session().get(raw_url, headers=_gh_headers(), timeout=15, stream=True) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(chunk_size=65536):
+            h.update(chunk)
+            chunks.append(chunk)
+    data = b"".join(chunks)
+    if len(data) != size or h.hexdigest() != expected_sha:
+        raise RuntimeError(f"blob SHA mismatch (got {h.hexdigest()}, {len(data)} bytes)")
+    return data
 
 def _atomic_replace(target_path: str, new_bytes: bytes):
     d = os.path.dirname(target_path) or "."
@@ -64,49 +307,101 @@ def _atomic_replace(target_path: str, new_bytes: bytes):
         shutil.copy2(target_path, backup)
     os.replace(tmp, target_path)
 
-def maybe_self_update():
+def _rollback(target_path: str):
+    backup = target_path + ".bak"
+    if os.path.exists(backup):
+        shutil.copy2(backup, target_path)
+        print("[update] rolled back to previous version")
+
+def _smoke_test(path: str) -> bool:
+    """Load the new file in a child interpreter (module level only, no __main__ block),
+       then run its CLI (`status`) in a throwaway directory, so a version that imports
+       but crashes in main() is rolled back too."""
+    path = os.path.abspath(path)
+    with tempfile.TemporaryDirectory(prefix="update-smoke-") as tmp:
+        # Throwaway state: the check must not touch the real outbox or cursor
+        env = dict(os.environ, STATE_DIR=tmp, METRICS_LOG="", METRICS_PROM="")
+        steps = {
+            "import": [sys.executable, "-c",
+                       "import runpy, sys; runpy.run_path(sys.argv[1], run_name='__smoke__')", path],
+            "status": [sys.executable, path, "status"],
+        }
+        for step, cmd in steps.items():
+            try:
+                r = subprocess.run(cmd, capture_output=True, text=True, timeout=60, cwd=tmp, env=env)
+            except Exception as e:
+                print(f"[update] smoke test could not run: {e}")
+                return False
+            if r.returncode != 0:
+                print(f"[update] smoke test failed at {step} (exit {r.returncode}):\n"
+                      f"{r.stderr.strip()[-2000:]}")
+                return False
+    return True
+
+def check_for_update():
+    """Network half of the updater: returns a verified (sha, etag, bytes) to apply,
+       or None. Touches nothing on disk except the SHA/ETag cache."""
+    cached_sha, cached_etag = _read_update_cache()
     try:
-        remote_sha, raw_url = _fetch_remote_meta()
+        # Conditional request: an unchanged file costs a single 304 and no download
+        meta = _fetch_remote_meta(cached_etag if cached_sha else None)
     except Exception as e:
         print(f"[update] skip (GitHub query failed): {e}")
-        return
+        return None
+    if meta is None:
+        print("[update] already latest (304)")
+        return None
+    remote_sha, raw_url, size, etag = meta
 
     # If we’ve already seen this exact SHA, skip
-    if os.path.exists(SHA_CACHE):
+    if cached_sha == remote_sha:
+        _write_update_cache(remote_sha, etag)
+        print("[update] already latest")
+        return None
+
+    # No usable cache: compare against the running file before downloading anything
+    if cached_sha is None:
         try:
-            if open(SHA_CACHE, "r", encoding="utf-8").read().strip() == remote_sha:
-                print("[update] already latest")
-                return
+            with open(__file__, "rb") as f:
+                if _git_blob_sha(f.read()) == remote_sha:
+                    _write_update_cache(remote_sha, etag)
+                    print("[update] content unchanged; cache updated")
+                    return None
         except Exception:
             pass
 
-    # Download the raw file
-    r = requests.get(raw_url, headers=_gh_headers(), timeout=15)
-    if r.status_code != 200:
-        print(f"[update] download failed: {r.status_code}")
-        return
-    new_bytes = r.content
-
-    # Compare with current file contents to avoid needless rewrite
     try:
-        with open(__file__, "rb") as f:
-            cur_bytes = f.read()
-        if hashlib.sha256(cur_bytes).hexdigest() == hashlib.sha256(new_bytes).hexdigest():
-            # Content same but SHA cache stale — refresh it
-            with open(SHA_CACHE, "w", encoding="utf-8") as f:
-                f.write(remote_sha)
-            print("[update] content unchanged; cache updated")
-            return
-    except Exception:
-        pass
+        return remote_sha, etag, _download_verified(raw_url, size, remote_sha)
+    except Exception as e:
+        print(f"[update] download failed: {e}")
+        return None
 
+def apply_update(staged, restart=True):
+    """Disk half of the updater: swap in a staged version, smoke-test it and either
+       restart into it or leave it for the next run."""
+    remote_sha, etag, new_bytes = staged
     print("[update] applying update...")
     _atomic_replace(__file__, new_bytes)
-    with open(SHA_CACHE, "w", encoding="utf-8") as f:
-        f.write(remote_sha)
+    # Remember the SHA even if it gets rolled back, so a broken push is not retried every run
+    _write_update_cache(remote_sha, etag)
+    if not _smoke_test(__file__):
+        _rollback(__file__)
+        return
+    if not restart:
+        print("[update] installed; takes effect on the next run")
+        return
 
     print("[update] restarting...")
-    os.execv(sys.executable, [sys.executable] + sys.argv)
+    try:
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+    except OSError as e:
+        print(f"[update] restart failed: {e}")
+        _rollback(__file__)
+
+def maybe_self_update():
+    staged = check_for_update()
+    if staged:
+        apply_update(staged)
 
 def chrome_user_data_root():
     # Works on native Windows Python
@@ -131,8 +426,73 @@ def get_last_used_profile(root: Path):
             pass
     return CHROME_PROFILE_PATH
 
-def _copy_host_profile_once():
-    """Copy the mounted host Chrome profile into USER_DATA_DIR (first run only)."""
+PROFILE_IGNORE_NAMES = {"Cache", "Code Cache", "GPUCache", "GrShaderCache", "Media Cache"}
+PROFILE_LOCK_NAMES   = {"LOCK", "lockfile", "SingletonLock", "SingletonCookie", "SingletonSocket"}
+
+def _sync_skip(name: str) -> bool:
+    return name in PROFILE_IGNORE_NAMES or name in PROFILE_LOCK_NAMES or name.endswith(".tmp")
+
+def _load_sync_manifest() -> dict:
+    try:
+        return json.loads(SYNC_MANIFEST.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+def _save_sync_manifest(manifest: dict):
+    fd, tmp = tempfile.mkstemp(dir=SYNC_MANIFEST.parent, prefix=".manifest_", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(tmp, SYNC_MANIFEST)
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _walk_profile(src: Path, unreadable=None):
+    """Yield (relative path, os.stat_result) for every syncable file under src.
+       Directories that cannot be listed are added to `unreadable` (relative, posix)."""
+    stack = [src]
+    while stack:
+        d = stack.pop()
+        try:
+            entries = list(os.scandir(d))
+        except OSError as e:
+            print(f"[sync] cannot list {d}: {e}")
+            if unreadable is not None:
+                unreadable.append(d.relative_to(src).as_posix())
+            continue
+        for e in entries:
+            if _sync_skip(e.name):
+                continue
+            try:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(Path(e.path))
+                elif e.is_file(follow_symlinks=False):
+                    yield Path(e.path).relative_to(src).as_posix(), e.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+def _sync_one(src: Path, dst: Path, rel: str, st, prev):
+    """Copy one file if its content changed. Returns (manifest entry, bytes copied)."""
+    s, d = src / rel, dst / rel
+    digest = _file_sha256(s)
+    if prev and prev[2] == digest and d.exists():
+        return [st.st_size, st.st_mtime_ns, digest], 0
+    d.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(s, d)
+    return [st.st_size, st.st_mtime_ns, digest], st.st_size
+
+def _sync_host_profile():
+    """Delta-sync the host Chrome profile into USER_DATA_DIR.
+
+    A manifest of path -> [size, mtime_ns, sha256] is kept in USER_DATA_DIR;
+    files whose size/mtime still match are skipped without being read, the
+    rest are hashed and copied only if their content actually changed.
+    Files gone from the host profile since the last sync are deleted from
+    USER_DATA_DIR as well. Safe to run on every start."""
     root = chrome_user_data_root()
     src = Path(get_last_used_profile(root))
     dst = Path(USER_DATA_DIR)
@@ -141,20 +501,204 @@ def _copy_host_profile_once():
         print("[INFO] No host profile mounted; using existing/warm Playwright profile.")
         return
 
-    if SYNC_MARKER.exists():
-        return
+    t0 = time.monotonic()
+    manifest = _load_sync_manifest()
+    fresh, todo, unreadable = {}, [], []
+    for rel, st in _walk_profile(src, unreadable):
+        prev = manifest.get(rel)
+        if prev and prev[0] == st.st_size and prev[1] == st.st_mtime_ns and (dst / rel).exists():
+            fresh[rel] = prev
+        else:
+            todo.append((rel, st, prev))
 
-    if any(dst.iterdir()):
-        SYNC_MARKER.touch()
-        print("[INFO] USER_DATA_DIR already has data; skipping initial sync.")
-        return
+    copied_files = copied_bytes = failed = 0
+    if todo:
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as pool:
+            futs = {pool.submit(_sync_one, src, dst, rel, st, prev): rel for rel, st, prev in todo}
+            for fut in as_completed(futs):
+                rel = futs[fut]
+                try:
+                    entry, n = fut.result()
+                except OSError as e:
+                    # Typically a file held open by a running Chrome; retried next sync
+                    print(f"[sync] skip {rel}: {e}")
+                    failed += 1
+                    if manifest.get(rel):
+                        fresh[rel] = manifest[rel]   # still ours to delete if the host drops it
+                    continue
+                fresh[rel] = entry
+                if n:
+                    copied_files += 1
+                    copied_bytes += n
 
-    print(f"[INFO] Syncing host profile from {src} -> {dst} (one-time)")
-    def _ignore(dirpath, names):
-        ignore_names = {"Cache", "Code Cache", "GPUCache", "GrShaderCache", "Media Cache"}
-        return [n for n in names if n in ignore_names]
-    shutil.copytree(src, dst, dirs_exist_ok=True, ignore=_ignore)
-    SYNC_MARKER.touch()
+    # In the old manifest but not in this walk: removed on the host. Skip anything under
+    # a directory that could not be listed, since its files were simply not seen.
+    seen = set(fresh) | {rel for rel, _, _ in todo}
+    removed = 0
+    for rel, entry in manifest.items():
+        if rel in seen:
+            continue
+        if any(u == "." or rel.startswith(u + "/") for u in unreadable):
+            fresh[rel] = entry
+            continue
+        try:
+            (dst / rel).unlink(missing_ok=True)
+            removed += 1
+        except OSError as e:
+            print(f"[sync] cannot delete {rel}: {e}")
+            fresh[rel] = entry   # retried next sync
+
+    _save_sync_manifest(fresh)
+    print(f"[sync] {src} -> {dst}: {copied_files} file(s), {copied_bytes / 1048576:.1f} MiB copied, "
+          f"{len(fresh) - copied_files} unchanged, {removed} removed, {failed} failed "
+          f"in {time.monotonic() - t0:.2f}s")
+
+# --- Wait engine: race page conditions against one shared deadline ---
+class Deadline:
+    """Overall time budget shared by every wait in one run."""
+    def __init__(self, seconds: float):
+        self.end = time.monotonic() + seconds
+
+    def ms(self, cap_ms=None) -> int:
+        """Milliseconds left, optionally capped. Never below 1, because Playwright
+           treats timeout=0 as "wait forever"."""
+        left = max(1, int((self.end - time.monotonic()) * 1000))
+        return left if cap_ms is None else min(left, cap_ms)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.end
+
+def on_selector(page, selector, state="visible"):
+    return lambda t: page.locator(selector).first.wait_for(state=state, timeout=t)
+
+def on_url(page, predicate):
+    return lambda t: page.wait_for_url(predicate, timeout=t)
+
+def on_response(page, predicate):
+    return lambda t: page.wait_for_event("response", predicate=predicate, timeout=t)
+
+async def race(deadline: Deadline, cap_ms=None, **conditions):
+    """Start every condition at once and return the name of the first one that is
+       satisfied, or None once the (capped) budget runs out. Conditions that fail
+       early (e.g. a detached frame) drop out of the race without ending it."""
+    if deadline.expired() or not conditions:
+        return None
+    timeout = deadline.ms(cap_ms)
+    tasks = {asyncio.ensure_future(make(timeout)): name for name, make in conditions.items()}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=timeout / 1000 + 1,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for t in done:
+                if not t.cancelled() and t.exception() is None:
+                    return tasks[t]
+        return None
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# --- Profile maintenance: keep USER_DATA_DIR small without touching session state ---
+# Everything the sync skips, plus other caches Chromium rebuilds on demand. Cookies,
+# Local Storage, IndexedDB, Session Storage and Login Data are never touched.
+PROFILE_PRUNE_NAMES = PROFILE_IGNORE_NAMES | {
+    "ShaderCache", "DawnCache", "DawnGraphiteCache", "DawnWebGPUCache", "GraphiteDawnCache",
+    "CacheStorage", "ScriptCache", "Crashpad", "BrowserMetrics", "component_crx_cache",
+    "optimization_guide_model_store", "optimization_guide_prediction_model_downloads",
+}
+_SQLITE_MAGIC = b"SQLite format 3\0"
+
+def _dir_size(root: Path) -> int:
+    total, stack = 0, [root]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for e in entries:
+            try:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(Path(e.path))
+                elif e.is_file(follow_symlinks=False):
+                    total += e.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+    return total
+
+def _profile_in_use(root: Path) -> bool:
+    # SingletonLock is a (possibly dangling) symlink on Linux; lockfile is the Windows one
+    return any(os.path.lexists(root / n) for n in ("SingletonLock", "lockfile"))
+
+def _prune_caches(root: Path) -> int:
+    """Delete every cache directory under root; returns bytes freed."""
+    freed, stack = 0, [root]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for e in entries:
+            if not e.is_dir(follow_symlinks=False):
+                continue
+            if e.name in PROFILE_PRUNE_NAMES:
+                size = _dir_size(Path(e.path))
+                shutil.rmtree(e.path, ignore_errors=True)
+                freed += size - _dir_size(Path(e.path))   # whatever a locked file kept behind
+            else:
+                stack.append(Path(e.path))
+    return freed
+
+def _vacuum_sqlite(root: Path) -> int:
+    """VACUUM every SQLite database in the profile (rows are kept, so sessions survive)."""
+    freed = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            path = Path(dirpath) / name
+            if name.endswith(("-journal", "-wal", "-shm")):
+                continue
+            try:
+                with open(path, "rb") as f:
+                    if f.read(16) != _SQLITE_MAGIC:
+                        continue
+                before = path.stat().st_size
+                with closing(sqlite3.connect(path, timeout=5)) as conn:
+                    conn.execute("VACUUM")
+                freed += before - path.stat().st_size
+            except (OSError, sqlite3.Error) as e:
+                print(f"[maintain] vacuum skipped for {path.name}: {e}")
+    return freed
+
+def maintain_profile(budget_mb=None) -> bool:
+    """Prune caches and vacuum databases in USER_DATA_DIR, reporting sizes before and
+       after. With a budget, nothing is done while the profile fits in it. Returns
+       False if maintenance was skipped because the profile is in use."""
+    root = Path(USER_DATA_DIR)
+    if not root.exists():
+        return True
+    before = _dir_size(root)
+    if budget_mb and before <= budget_mb * 1048576:
+        return True
+    if _profile_in_use(root):
+        print("[maintain] profile is in use by a running browser; skipped")
+        return False
+    t0 = time.monotonic()
+    pruned = _prune_caches(root)
+    vacuumed = _vacuum_sqlite(root)
+    after = _dir_size(root)
+    print(f"[maintain] {before / 1048576:.1f} MiB -> {after / 1048576:.1f} MiB "
+          f"(caches {pruned / 1048576:.1f} MiB, vacuum {vacuumed / 1048576:.1f} MiB) "
+          f"in {time.monotonic() - t0:.1f}s")
+    if budget_mb and after > budget_mb * 1048576:
+        biggest = sorted(((_dir_size(Path(e.path)), e.name) for e in os.scandir(root) if e.is_dir()),
+                         reverse=True)[:5]
+        print(f"[maintain] still over the {budget_mb} MiB budget; largest: "
+              + ", ".join(f"{n} {sz / 1048576:.0f} MiB" for sz, n in biggest))
+    count("profile_bytes_freed", before - after)
+    return True
 
 async def random_clicks_any_resolution(page,
                                        clicks=3,
@@ -185,12 +729,43 @@ async def random_clicks_any_resolution(page,
 
         await page.wait_for_timeout(random.randint(min_pause_ms, max_pause_ms))
 
-def _normalize_amount(txt: str) -> str:
-    if not txt: return ""
-    t = txt.strip().replace("\u00A0", " ")
-    t = t.replace(",", "")  
-    m = re.findall(r"[0-9.]+", t)
-    return m[0] if m else txt.strip()
+Wallet = namedtuple("Wallet", "amount currency")
+
+def _parse_amount(whole: str, frac: str = "") -> Decimal:
+    """Locale-aware amount parsing for the split '1,234' + '.56' (or '1.234' + ',56')
+       rendering. AMOUNT_DECIMAL_SEP forces the decimal separator when set."""
+    t = (whole or "") + (frac or "")
+    w = (whole or "").strip()
+    neg = "-" in t or "\u2212" in t or (w.startswith("(") and w.endswith(")"))
+    t = re.sub(r"[^0-9.,']", "", t)
+    if not re.search(r"\d", t):
+        raise InvalidOperation(f"no digits in {whole!r}{frac!r}")
+    sep = AMOUNT_DECIMAL_SEP
+    if not sep:
+        f = re.sub(r"^[^0-9.,]*", "", frac or "")
+        if f[:1] in (".", ","):
+            sep = f[0]                          # the decimal part carries its own separator
+        else:
+            seps = [c for c in t if c in ".,"]
+            if len(set(seps)) == 2:
+                sep = seps[-1]                  # 1.234,56 / 1,234.56
+            elif len(seps) == 1:
+                head, _, tail = t.partition(seps[0])
+                head = re.sub(r"\D", "", head)
+                # 12,5 / 12.50 / 0.500 / 1234.567 are decimals; only 1-3 non-zero digits
+                # then exactly three (1,234 / 12.500) read as a grouped integer
+                if len(tail) == 3 and 1 <= len(head) <= 3 and head.strip("0"):
+                    print(f"[WARN] Ambiguous amount {(whole or '') + (frac or '')!r} read as {head}{tail}; "
+                          f"set AMOUNT_DECIMAL_SEP if it is a decimal")
+                else:
+                    sep = seps[0]
+    if sep:
+        head, _, tail = t.rpartition(sep)
+        t = re.sub(r"\D", "", head) + "." + re.sub(r"\D", "", tail)
+    else:
+        t = re.sub(r"\D", "", t)
+    amount = Decimal(t)
+    return -amount if neg else amount
 
 async def handle_cookie_banner(page):
     """Automatically reject cookies if OneTrust banner appears."""
@@ -198,11 +773,11 @@ async def handle_cookie_banner(page):
         if await page.locator('#onetrust-reject-all-handler').count():
             await page.click('#onetrust-reject-all-handler')
             print("[INFO] Cookie banner detected → clicked Reject All")
-            await page.wait_for_timeout(1500)  
+            await race(Deadline(1.5), gone=on_selector(page, '#onetrust-reject-all-handler', "hidden"))
         elif await page.locator('#onetrust-accept-btn-handler').count():
             print("[INFO] Cookie banner detected → fallback to Accept All (Reject not found)")
             await page.click('#onetrust-accept-btn-handler')
-            await page.wait_for_timeout(1500)
+            await race(Deadline(1.5), gone=on_selector(page, '#onetrust-accept-btn-handler', "hidden"))
     except Exception as e:
         print(f"[WARN] Cookie banner handling failed: {e}")
 async def detect_captcha(page) -> bool:
@@ -224,10 +799,11 @@ async def detect_captcha(page) -> bool:
         pass
     return False
 
-async def attempt_login_once(page, email, password):
+async def attempt_login_once(page, email, password, deadline=None):
     """Fill creds, wait for enabled submit, and submit once.
        If submit can’t be clicked, click random safe spots 2–3× then retry."""
-    EMAIL_SEL = 'input[id^="user_authentication_email"]'
+    deadline = deadline or Deadline(RUN_BUDGET)
+    EMAIL_SEL = LOGIN_EMAIL_SEL
     PASS_SEL  = 'input[type="password"]'
     SUBMIT_ANY   = '#login_button button[type="submit"], form button[type="submit"]'
     SUBMIT_READY = '#login_button button[type="submit"]:not([disabled]), form button[type="submit"]:not([disabled])'
@@ -245,7 +821,7 @@ async def attempt_login_once(page, email, password):
 
     # Wait for submit to enable (if it never does, we’ll still try fallback)
     try:
-        await page.locator(SUBMIT_READY).first.wait_for(timeout=5000)
+        await page.locator(SUBMIT_READY).first.wait_for(timeout=deadline.ms(5000))
     except Exception:
         print("[WARN] Submit button stayed disabled; continuing anyway")
 
@@ -285,8 +861,17 @@ async def attempt_login_once(page, email, password):
         except Exception as e:
             print(f"[WARN] Enter key failed: {e}")
 
-    # Wait for possible navigation
-    await page.wait_for_timeout(1500)
+    # Wait for whatever the submit triggers first: navigation, a captcha frame or
+    # the balance itself. A navigation settles nothing yet: the challenge can still
+    # be injected into the new page, so give the captcha or the balance a short
+    # window to show up before checking.
+    login_url = page.url
+    captcha = on_selector(page, CAPTCHA_FRAME_SEL, "attached")
+    balance = on_selector(page, BALANCE_SELECTOR_MAIN)
+    state = await race(deadline, cap_ms=15000, captcha=captcha, balance=balance,
+                       navigated=on_url(page, lambda u: u != login_url))
+    if state == "navigated":
+        await race(deadline, cap_ms=5000, captcha=captcha, balance=balance)
 
     # ✅ Detect CAPTCHA right after clicking submit
     if await detect_captcha(page):
@@ -294,7 +879,7 @@ async def attempt_login_once(page, email, password):
         # Locate the button by its ID
         button = frame.locator('#recaptcha-audio-button')
         # Wait until it appears and is visible
-        await button.wait_for(state='visible')
+        await button.wait_for(state='visible', timeout=deadline.ms(30000))
         # Get the bounding box
         box = await button.bounding_box()
         if box:
@@ -313,6 +898,7 @@ async def attempt_login_once(page, email, password):
             await page.mouse.click(click_x, click_y)
         else:
             print("Button not found or not visible.")
+        aai = _import("assemblyai")
         aai.settings.api_key = os.getenv("AAI_KEY")
         audio_file = await frame.locator("#audio-source").evaluate("el => el.src")
         config = aai.TranscriptionConfig(speech_model=aai.SpeechModel.universal)
@@ -326,7 +912,7 @@ async def attempt_login_once(page, email, password):
         # Locate the button by its ID
         button = frame.locator('#recaptcha-verify-button')
         # Wait until it appears and is visible
-        await button.wait_for(state='visible')
+        await button.wait_for(state='visible', timeout=deadline.ms(30000))
         # Get the bounding box
         box = await button.bounding_box()
         if box:
@@ -345,143 +931,1412 @@ async def attempt_login_once(page, email, password):
             await page.mouse.click(click_x, click_y)
         else:
             print("Button not found or not visible.")
-    # Wait for network to settle
-    await page.wait_for_load_state("networkidle", timeout=15000)
-    await page.wait_for_timeout(1500)
-    for i in range(10):
-        try:
-            await page.locator(BALANCE_SELECTOR_MAIN).first.wait_for(timeout=8000)
-        except Exception:
-            pass
+    # Return as soon as the balance renders (or the budget slice runs out)
+    await race(deadline, cap_ms=30000, balance=on_selector(page, BALANCE_SELECTOR_MAIN))
     return True
 
-async def ensure_logged_in(page, email, password, balance_selector_main):
-    """Try up to 5 times: handle cookie, try login, wait for balance; else reload."""
+async def ensure_logged_in(page, email, password, balance_selector_main, deadline=None):
+    """Try up to 5 times: handle cookie, try login, wait for balance; else reload.
+       Every wait draws on one shared deadline instead of fixed per-step timeouts."""
     MAX_TRIES = 5
+    deadline = deadline or Deadline(RUN_BUDGET)
+    balance = on_selector(page, balance_selector_main)
+    login = on_selector(page, LOGIN_EMAIL_SEL)
     for i in range(1, MAX_TRIES + 1):
         print(f"[INFO] Login/balance attempt {i}/{MAX_TRIES}")
+        if i > 1:
+            count("login_retries")
+
+        # Whichever shows first: balance, login form or the cookie banner
+        state = await race(deadline, cap_ms=15000, balance=balance, login=login,
+                           banner=on_selector(page, COOKIE_BANNER_SEL))
+        if state == "banner":
+            await handle_cookie_banner(page)
+            state = await race(deadline, cap_ms=15000, balance=balance, login=login)
 
         # If the balance is already visible, we’re done
-        if await page.locator(balance_selector_main).count():
+        if state == "balance":
             print("[INFO] Already logged in (balance visible)")
             return True
 
         # If a login form exists, attempt to log in once
-        if await page.locator('input[id^="user_authentication_email"]').count():
-            await attempt_login_once(page, email, password)
+        if state == "login":
+            count("login_attempts")
+            await attempt_login_once(page, email, password, deadline)
+
+            # After potential login, check for balance
+            if await race(deadline, cap_ms=8000, balance=balance) == "balance":
+                print("[INFO] Balance located → login succeeded")
+                return True
 
-        # After potential login, check for balance
+        if deadline.expired():
+            print("[WARN] Run budget exhausted")
+            break
+        print("[WARN] Balance not visible yet → reloading page")
+        count("page_reloads")
         try:
-            await page.locator(balance_selector_main).first.wait_for(timeout=8000)
-            print("[INFO] Balance located → login succeeded")
-            return True
-        except Exception:
-            print("[WARN] Balance not visible yet → reloading page")
-            try:
-                await page.reload(wait_until="networkidle", timeout=20000)
-                await page.wait_for_timeout(1500)
-                # Handle cookie popup again if it reappears
-                await handle_cookie_banner(page)
-            except Exception as e:
-                print(f"[WARN] Reload failed: {e}")
+            await page.reload(wait_until="domcontentloaded", timeout=deadline.ms(20000))
+        except Exception as e:
+            print(f"[WARN] Reload failed: {e}")
 
     return False
 
-async def _fetch_balance():
-    async with async_playwright() as p:
-        browser = await p.chromium.launch_persistent_context(
-            user_data_dir=USER_DATA_DIR,
-            headless=False,
-            args=[
-                "--disable-blink-features=AutomationControlled",
-                "--disable-infobars",
-                "--start-maximized"
-                "--no-sandbox",                # required in most Docker runs
-                "--disable-dev-shm-usage",     # use /tmp if /dev/shm is small
-                "--disable-gpu",               # safer on VMs
-                "--disable-software-rasterizer"
-            ]
-        )
-        page = await browser.new_page()
-        stealth_js = r"""
-        Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
-        window.chrome = { runtime: {} };
-        Object.defineProperty(navigator, 'languages', { get: () => ['en-US','en'] });
-        Object.defineProperty(navigator, 'plugins', { get: () => [{name:'Chrome PDF Plugin'}] });
-        Object.defineProperty(navigator, 'mimeTypes', { get: () => [{type:'application/pdf'}] });
-        Object.defineProperty(navigator, 'hardwareConcurrency', { get: () => 8 });
-        Object.defineProperty(navigator, 'deviceMemory', { get: () => 8 });
-
-        const origQuery = window.navigator.permissions.query;
-        window.navigator.permissions.__proto__.query = function(parameters) {
-        if (parameters && parameters.name === 'notifications') {
-            return Promise.resolve({ state: Notification.permission });
-        }
-        return origQuery.apply(this, [parameters]);
-        };
-
-        const getParameter = WebGLRenderingContext.prototype.getParameter;
-        WebGLRenderingContext.prototype.getParameter = function(parameter) {
-        if (parameter === 37445) return 'Intel Inc.';
-        if (parameter === 37446) return 'Intel Iris';
-        return getParameter.call(this, parameter);
-        };
-        """
-        await page.add_init_script(stealth_js)
-        await page.goto(DASHBOARD_URL, wait_until="networkidle")
-
-        # 1) Cookie banner
+# Rough transfer sizes used to estimate what a blocked request would have cost
+_ROUTE_EST_BYTES = {"image": 30_000, "font": 40_000, "media": 250_000, "script": 25_000}
+
+async def _route_handler(route):
+    req = route.request
+    url = req.url
+    if any(fnmatch(url, pat) for pat in ROUTE_ALLOW_URLS):
+        return await route.continue_()
+    rtype = req.resource_type
+    if rtype in ROUTE_BLOCK_TYPES:
+        count("route_blocked")
+        count("route_saved_bytes_est", _ROUTE_EST_BYTES.get(rtype, 10_000))
+        return await route.abort()
+    if any(fnmatch(url, pat) for pat in ROUTE_BLOCK_URLS):
+        count("route_blocked")
+        count("route_saved_bytes_est", _ROUTE_EST_BYTES.get(rtype, 10_000))
+        if rtype == "script":
+            # Stub rather than abort so page code waiting on the tag's onload still runs
+            return await route.fulfill(status=200, content_type="application/javascript", body="")
+        return await route.abort()
+    await route.continue_()
+
+STEALTH_JS = r"""
+    Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
+    window.chrome = { runtime: {} };
+    Object.defineProperty(navigator, 'languages', { get: () => ['en-US','en'] });
+    Object.defineProperty(navigator, 'plugins', { get: () => [{name:'Chrome PDF Plugin'}] });
+    Object.defineProperty(navigator, 'mimeTypes', { get: () => [{type:'application/pdf'}] });
+    Object.defineProperty(navigator, 'hardwareConcurrency', { get: () => 8 });
+    Object.defineProperty(navigator, 'deviceMemory', { get: () => 8 });
+
+    const origQuery = window.navigator.permissions.query;
+    window.navigator.permissions.__proto__.query = function(parameters) {
+    if (parameters && parameters.name === 'notifications') {
+        return Promise.resolve({ state: Notification.permission });
+    }
+    return origQuery.apply(this, [parameters]);
+    };
+
+    const getParameter = WebGLRenderingContext.prototype.getParameter;
+    WebGLRenderingContext.prototype.getParameter = function(parameter) {
+    if (parameter === 37445) return 'Intel Inc.';
+    if (parameter === 37446) return 'Intel Iris';
+    return getParameter.call(this, parameter);
+    };
+    """
+
+BASE_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--disable-infobars",
+    "--no-sandbox",                # required in most Docker runs
+    "--disable-dev-shm-usage",     # use /tmp if /dev/shm is small
+    "--disable-gpu",               # safer on VMs
+    "--disable-software-rasterizer",
+]
+LOWRES_ARGS = [
+    "--renderer-process-limit=1",
+    "--disable-site-isolation-trials",
+    # No --disable-features here: Chromium honours only the last one, and Playwright
+    # passes its own list (which already covers Translate, OptimizationHints, MediaRouter)
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-sync",
+    "--mute-audio",
+    "--no-first-run",
+    "--disk-cache-size=33554432",
+]
+
+def _validate_flags(args):
+    """Reject malformed Chromium flags (a missing comma in a list literal silently
+       glues two of them together) and warn about flags given twice."""
+    seen = {}
+    for a in args:
+        if not a.startswith("--") or " " in a or "--" in a[2:].split("=", 1)[0]:
+            raise ValueError(f"malformed browser flag {a!r}")
+        name = a.split("=", 1)[0]
+        if name == "--disable-features":
+            raise ValueError("--disable-features would replace Playwright's own list; "
+                             "drop it or extend Playwright's defaults instead")
+        if name in seen and seen[name] != a:
+            print(f"[WARN] browser flag {name} given twice ({seen[name]!r}, {a!r}); the last one wins")
+        seen[name] = a
+    return args
+
+def _viewport():
+    w, _, h = BROWSER_VIEWPORT.lower().partition("x")
+    return {"width": int(w), "height": int(h)}
+
+def _launch_options():
+    """launch_persistent_context kwargs for the selected BROWSER_PROFILE / BROWSER_DISPLAY."""
+    lowres = BROWSER_PROFILE == "lowres"
+    display = BROWSER_DISPLAY or ("headless" if lowres or PW_HEADLESS else "headed")
+    if display not in ("headed", "headless", "xvfb"):
+        raise ValueError(f"BROWSER_DISPLAY must be headed, headless or xvfb, not {display!r}")
+    args = list(BASE_ARGS)
+    opts = {"headless": display == "headless"}
+    if lowres:
+        args += LOWRES_ARGS
+        if BROWSER_MEM_MB:
+            # Leave room for the browser and GPU processes under the overall ceiling
+            args.append(f"--js-flags=--max-old-space-size={max(64, BROWSER_MEM_MB // 3)}")
+    if lowres or display == "xvfb":
+        opts["viewport"] = _viewport()
+        args.append("--window-size={width},{height}".format(**opts["viewport"]))
+    elif display == "headed":
+        args.append("--start-maximized")
+    args += BROWSER_EXTRA_ARGS.split()
+    opts["args"] = _validate_flags(args)
+    return display, opts
+
+def _start_xvfb():
+    """Start a private Xvfb server; returns (process, DISPLAY value)."""
+    vp = _viewport()
+    for n in range(99, 120):
+        if os.path.exists(f"/tmp/.X11-unix/X{n}") or os.path.exists(f"/tmp/.X{n}-lock"):
+            continue
+        proc = subprocess.Popen(["Xvfb", f":{n}", "-screen", "0", f"{vp['width']}x{vp['height']}x24",
+                                 "-nolisten", "tcp"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(50):
+            if os.path.exists(f"/tmp/.X11-unix/X{n}"):
+                return proc, f":{n}"
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+        proc.kill()
+    raise RuntimeError("could not start Xvfb (is it installed?)")
+
+def _tree_usage(exclude=()):
+    """(rss bytes, cpu seconds) of every descendant of this process: the Playwright
+       driver and all Chromium processes, minus the pids in `exclude` (our own Xvfb).
+       Uses psutil where installed, /proc otherwise; None where neither is available."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil:
+        rss = cpu = 0
+        for p in psutil.Process().children(recursive=True):
+            if p.pid in exclude:
+                continue
+            try:
+                rss += p.memory_info().rss
+                t = p.cpu_times()
+                cpu += t.user + t.system
+            except psutil.Error:
+                pass
+        return rss, cpu
+    if not os.path.isdir("/proc"):
+        return None
+    stats = {}
+    for pid in os.listdir("/proc"):
+        if pid.isdigit():
+            try:
+                with open(f"/proc/{pid}/stat", "rb") as f:
+                    fields = f.read().rsplit(b")", 1)[1].split()
+                stats[int(pid)] = fields
+            except OSError:
+                pass
+    # fields[0] is the state (field 3 of stat); ppid, utime, stime and rss follow
+    children = {}
+    for pid, fields in stats.items():
+        children.setdefault(int(fields[1]), []).append(pid)
+    tick, page = os.sysconf("SC_CLK_TCK"), os.sysconf("SC_PAGE_SIZE")
+    rss = cpu = 0
+    stack = list(children.get(os.getpid(), []))
+    while stack:
+        pid = stack.pop()
+        if pid in exclude:
+            continue
+        fields = stats[pid]
+        rss += int(fields[21]) * page
+        cpu += (int(fields[11]) + int(fields[12])) / tick
+        stack.extend(children.get(pid, []))
+    return rss, cpu
+
+async def _watch_resources(browser, interval=0.5, exclude=()):
+    """Record peak RSS / CPU of the browser tree and close it above BROWSER_MEM_MB.
+       The process scan runs in a worker thread to keep it off the event loop."""
+    while True:
+        usage = await asyncio.to_thread(_tree_usage, exclude)
+        if usage is None:
+            print("[resources] process usage unavailable (install psutil); "
+                  "peak RSS/CPU and the BROWSER_MEM_MB ceiling are disabled")
+            return
+        rss, cpu = usage
+        gauge_max("browser_peak_rss_bytes", rss)
+        gauge_max("browser_cpu_seconds", round(cpu, 2))
+        if BROWSER_MEM_MB and rss > BROWSER_MEM_MB * 1048576:
+            print(f"[WARN] browser RSS {rss / 1048576:.0f} MiB over the {BROWSER_MEM_MB} MiB ceiling → closing")
+            count("mem_ceiling_hits")
+            await browser.close()
+            return
+        await asyncio.sleep(interval)
+
+async def _launch_context(p):
+    """Launch the persistent Chromium context and open the working page."""
+    if PROFILE_BUDGET_MB and PROFILE_MAINTAIN_ON_LAUNCH:
+        with span("profile_maintain"):
+            # Prune + VACUUM can take seconds; keep it off the event loop
+            await asyncio.to_thread(maintain_profile, PROFILE_BUDGET_MB)
+    display, opts = _launch_options()
+    xvfb = None
+    if display == "xvfb":
+        xvfb, display_num = _start_xvfb()
+        opts["env"] = {**os.environ, "DISPLAY": display_num}
+    try:
+        browser = await p.chromium.launch_persistent_context(user_data_dir=USER_DATA_DIR, **opts)
+    except Exception:
+        if xvfb:
+            xvfb.terminate()
+        raise
+    # Xvfb is ours, not the browser's: keep it out of the ceiling
+    watcher = asyncio.ensure_future(_watch_resources(browser, exclude={xvfb.pid} if xvfb else ()))
+
+    def on_close(_):
+        watcher.cancel()
+        if xvfb:
+            xvfb.terminate()
+    browser.on("close", on_close)
+    if ROUTE_BLOCK:
+        await browser.route("**/*", _route_handler)
+    page = await browser.new_page()
+    await page.add_init_script(STEALTH_JS)
+    return browser, page
+
+# --- Failure traces: recent page events are kept in memory and written out only on failure ---
+def _trace_attach(page):
+    """Ring buffer of the last TRACE_EVENTS console messages, page errors, navigations
+       and responses on `page`. Handlers only append a tuple; nothing is formatted or
+       written unless the run fails."""
+    events = deque(maxlen=TRACE_EVENTS)
+    if not TRACE_DIR:
+        return events
+    now = time.time
+
+    def on_nav(frame):
+        if frame == page.main_frame:
+            events.append((now(), "navigated", None, frame.url))
+
+    page.on("console", lambda m: events.append((now(), "console", m.type, m.text)))
+    page.on("pageerror", lambda e: events.append((now(), "pageerror", None, str(e))))
+    page.on("response", lambda r: events.append((now(), "response", r.status, r.url)))
+    page.on("requestfailed", lambda r: events.append((now(), "requestfailed", r.failure, r.url)))
+    page.on("framenavigated", on_nav)
+    return events
+
+def _trace_evict(root: Path, budget_mb: float):
+    """Delete the oldest traces until the directory fits the budget; the newest is kept.
+       Half-written traces left by a crashed run are removed after an hour."""
+    traces = []
+    for e in os.scandir(root):
+        if not e.is_dir():
+            continue
+        if not e.name.startswith("."):
+            traces.append(e)
+        elif e.name.endswith(".tmp") and time.time() - e.stat().st_mtime > 3600:
+            shutil.rmtree(e.path, ignore_errors=True)
+    traces.sort(key=lambda e: e.name)
+    sizes = [_dir_size(Path(e.path)) for e in traces]
+    total = sum(sizes)
+    for e, size in zip(traces[:-1], sizes):
+        if total <= budget_mb * 1048576:
+            break
+        shutil.rmtree(e.path, ignore_errors=True)
+        total -= size
+        print(f"[trace] evicted {e.name} ({size / 1048576:.1f} MiB)")
+
+async def _trace_dump(page, events, error):
+    """Write the buffered events, the error, a screenshot and a DOM snapshot to a new
+       directory under TRACE_DIR. Never raises: the original failure is what matters."""
+    if not TRACE_DIR:
+        return
+    root = Path(TRACE_DIR)
+    name = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+    tmp = root / f".{name}.tmp"
+    try:
+        with span("trace_dump"):
+            tmp.mkdir(parents=True, exist_ok=True)
+            with open(tmp / "events.jsonl", "w", encoding="utf-8") as f:
+                for ts, kind, detail, text in events:
+                    f.write(json.dumps({"ts": round(ts, 3), "kind": kind, "detail": detail,
+                                        "text": text}) + "\n")
+            url = "" if page.is_closed() else page.url
+            (tmp / "error.txt").write_text(f"{type(error).__name__}: {error}\nurl: {url}\n",
+                                           encoding="utf-8")
+            if not page.is_closed():
+                try:
+                    await page.screenshot(path=str(tmp / "screenshot.png"), timeout=10000)
+                except Exception as e:
+                    print(f"[trace] screenshot failed: {e}")
+                try:
+                    (tmp / "dom.html").write_text(await page.content(), encoding="utf-8")
+                except Exception as e:
+                    print(f"[trace] DOM snapshot failed: {e}")
+            os.replace(tmp, root / name)
+        count("traces_written")
+        print(f"[trace] failure captured in {root / name} ({len(events)} events)")
+        _trace_evict(root, TRACE_BUDGET_MB)
+    except Exception as e:
+        print(f"[trace] could not write trace: {e}")
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _json_amount(amt) -> Decimal:
+    """Plain machine numbers as they are; formatted strings ("1.234,56") are parsed
+       with the same locale rules as the DOM."""
+    if isinstance(amt, str) and not re.fullmatch(r"\s*-?\d+(\.\d+)?\s*", amt):
+        return _parse_amount(amt)
+    return Decimal(str(amt).strip())
+
+def _wallets_from_json(data):
+    """(Decimal amount, currency) for every object in the payload that carries one of
+       BALANCE_AMOUNT_KEYS next to one of BALANCE_CURRENCY_KEYS, in document order."""
+    out, stack = [], [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            amt = next((node[k] for k in BALANCE_AMOUNT_KEYS if k in node), None)
+            cur = next((node[k] for k in BALANCE_CURRENCY_KEYS if k in node), None)
+            if isinstance(amt, (int, str, Decimal)) and not isinstance(amt, bool) and isinstance(cur, str):
+                try:
+                    out.append((_json_amount(amt), cur.strip()))
+                except InvalidOperation:
+                    pass
+            stack.extend(reversed(list(node.values())))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+    return out
+
+def _capture_balance_response(page):
+    """Listen for the dashboard's wallet JSON; returns a future that resolves to the
+       parsed wallets. Must be attached before navigation."""
+    fut = asyncio.get_running_loop().create_future()
+
+    async def on_response(response):
+        if fut.done() or not any(fnmatch(response.url, pat) for pat in BALANCE_API_URLS):
+            return
+        if "json" not in (response.headers.get("content-type") or ""):
+            return
+        try:
+            # parse_float=Decimal keeps the exact value the server sent
+            wallets = _wallets_from_json(json.loads(await response.text(), parse_float=Decimal))
+        except Exception:
+            return
+        if wallets and not fut.done():
+            fut.set_result(wallets)
+
+    page.on("response", on_response)
+    # Detach once resolved, or once the caller cancels it after falling back to the DOM
+    fut.add_done_callback(lambda _: page.remove_listener("response", on_response))
+    return fut
+
+async def _extract_balance(page, warm=False, capture=None):
+    """Run the login/extraction flow on a page already pointed at DASHBOARD_URL.
+       A warm page (daemon tick) skips the exploratory clicks. With a `capture`
+       future from _capture_balance_response, the wallet payload wins as soon as
+       it arrives; the rendered DOM is the fallback. Returns every Wallet found,
+       the primary (first) one first."""
+    # 1) Cookie banner
+    with span("cookie_banner"):
         await handle_cookie_banner(page)
 
+    if not warm:
         # Simulate 3 random exploratory clicks
-        await random_clicks_any_resolution(page, clicks=3)
+        with span("random_clicks"):
+            await random_clicks_any_resolution(page, clicks=3)
 
-        # 2) Ensure logged in (with retry/refresh logic)
-        ok = await ensure_logged_in(page, NETELLER_EMAIL, NETELLER_PASS, BALANCE_SELECTOR_MAIN)
-        if not ok:
-            await browser.close()
-            raise RuntimeError("Login failed after 5 attempts; check credentials/2FA or selectors.")
+    # 2) Ensure logged in (with retry/refresh logic); login and extraction share one budget
+    deadline = Deadline(RUN_BUDGET)
+    with span("ensure_logged_in"):
+        login = asyncio.ensure_future(
+            ensure_logged_in(page, NETELLER_EMAIL, NETELLER_PASS, BALANCE_SELECTOR_MAIN, deadline))
+        if capture is not None:
+            # The wallet payload is only served to a logged-in session, so its arrival
+            # settles the login question as well
+            await asyncio.wait({login, capture}, return_when=asyncio.FIRST_COMPLETED)
+            if capture.done() and not login.done():
+                login.cancel()
+                await asyncio.gather(login, return_exceptions=True)
+        ok = (capture is not None and capture.done()) or await login
+    if not ok:
+        if capture is not None:
+            capture.cancel()
+        raise RuntimeError("Login failed after 5 attempts; check credentials/2FA or selectors.")
+
+    if capture is not None and capture.done():
+        count("balance_from_api")
+        return [Wallet(amount, currency) for amount, currency in capture.result()]
+    if capture is not None:
+        capture.cancel()
+
+    with span("extract"):
+        return await _read_wallets(page, deadline)
+
+# Collects every wallet in one round trip. Each integer-part element is paired with
+# the decimal part and currency inside its own wallet box: the widest ancestor that
+# still contains only that one integer part.
+WALLETS_JS = r"""
+([mainSel, decSel, curSel]) => [...document.querySelectorAll(mainSel)].map(el => {
+    let box = el;
+    while (box.parentElement && box.parentElement.querySelectorAll(mainSel).length === 1) {
+        box = box.parentElement;
+    }
+    const text = sel => { const n = box.querySelector(sel); return n ? n.textContent.trim() : ""; };
+    return { whole: el.textContent.trim(), frac: text(decSel), currency: text(curSel) };
+})
+"""
+
+async def _read_wallets(page, deadline=None):
+    """Every wallet on the rendered dashboard as Wallet(Decimal amount, currency)."""
+    deadline = deadline or Deadline(RUN_BUDGET)
+    args = [BALANCE_SELECTOR_MAIN, BALANCE_SELECTOR_DEC, CURRENCY_SELECTOR]
+    # 3) + 4) Balance parts and currency for all wallets in one page.evaluate
+    raw = await page.evaluate(WALLETS_JS, args)
+    if not raw:
+        try:
+            await page.locator(BALANCE_SELECTOR_MAIN).first.wait_for(timeout=deadline.ms(30000))
+        except _import("playwright.async_api").TimeoutError:
+            raise RuntimeError("Balance element not found; update BALANCE_SELECTOR_MAIN/_DEC")
+        raw = await page.evaluate(WALLETS_JS, args)
 
-        # 3) Extract the split balance
+    wallets = []
+    for w in raw:
         try:
-            main_el = page.locator(BALANCE_SELECTOR_MAIN).first
-            await main_el.wait_for(timeout=30000)
-            main_text = (await main_el.text_content() or "").strip()
+            wallets.append(Wallet(_parse_amount(w["whole"], w["frac"]), w["currency"] or "USD"))
+        except InvalidOperation:
+            print(f"[WARN] Unparseable balance {w['whole']!r} + {w['frac']!r}; skipped")
+    if not wallets:
+        raise RuntimeError("Balance element not found; update BALANCE_SELECTOR_MAIN/_DEC")
+    return wallets
+
+# --- Transaction export: resumable from a cursor, appended locally and queued for push ---
+def _tx_time(value):
+    """Normalise an epoch (s or ms) or ISO-8601 timestamp to a UTC ISO string."""
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        secs = float(value) / (1000 if value > 1e11 else 1)
+        return datetime.fromtimestamp(secs, timezone.utc).isoformat(timespec="seconds")
+    if isinstance(value, str) and value.strip():
+        dt = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone(timezone.utc).isoformat(timespec="seconds")
+    raise ValueError(f"not a timestamp: {value!r}")
+
+def _transactions_from_json(data):
+    """{"id", "ts", "amount", "currency", "text"} for every object in the payload that
+       carries one of TX_ID_KEYS, TX_TIME_KEYS and TX_AMOUNT_KEYS, in document order.
+       An amount may be an object with its own value and currency."""
+    out, stack = [], [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+            continue
+        if not isinstance(node, dict):
+            continue
+        tid = next((node[k] for k in TX_ID_KEYS if k in node), None)
+        when = next((node[k] for k in TX_TIME_KEYS if k in node), None)
+        amt = next((node[k] for k in TX_AMOUNT_KEYS if k in node), None)
+        cur = next((node[k] for k in BALANCE_CURRENCY_KEYS if k in node), None)
+        if isinstance(amt, dict):
+            cur = next((amt[k] for k in BALANCE_CURRENCY_KEYS if k in amt), cur)
+            amt = next((amt[k] for k in TX_AMOUNT_KEYS if k in amt), None)
+        if tid is not None and when is not None and isinstance(amt, (int, str, Decimal)) \
+                and not isinstance(amt, bool):
+            try:
+                out.append({
+                    "id": str(tid),
+                    "ts": _tx_time(when),
+                    "amount": str(_json_amount(amt)),
+                    "currency": cur.strip() if isinstance(cur, str) else "",
+                    "text": " / ".join(str(node[k]) for k in TX_TEXT_KEYS if node.get(k)),
+                })
+                continue   # a transaction's own children are not transactions
+            except (ValueError, InvalidOperation):
+                pass
+        stack.extend(reversed(list(node.values())))
+    return out
+
+def tx_cursor():
+    """Export state, or None before the first export:
+         id, ts      newest exported transaction (where the next head scan stops)
+         gaps        [{page, until, after}] older stretches a capped run left unread,
+                     newest first: resume at `page`, skip rows up to `after`, stop at `until`
+         file_size   TX_FILE size after the last committed write"""
+    try:
+        with open(TX_CURSOR, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _tx_ref(row):
+    return {"id": row["id"], "ts": row["ts"]}
+
+def _tx_store(rows, state):
+    """Append rows to TX_FILE, queue them for TX_PUSH_URL and commit `state`. Bytes past the committed
+       file_size belong to a write whose state never landed (a crash); they are cut
+       before appending, and the outbox ignores transactions it already has, so the
+       re-fetch that follows a crash leaves no duplicates."""
+    committed = state.get("file_size")
+    if rows:
+        with open(TX_FILE, "ab") as f:
+            if committed is not None and f.tell() > committed:
+                f.truncate(committed)
+            f.write(b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in rows))
+            f.flush()
+            os.fsync(f.fileno())
+            state["file_size"] = f.tell()
+        if TX_PUSH_URL:
+            with closing(_outbox_conn()) as conn, conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO tx_outbox (tx_id, doc) VALUES (?, ?)",
+                    [(r["id"], json.dumps({**r, "vps": VPS})) for r in rows],
+                )
+    tmp = TX_CURSOR + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, TX_CURSOR)
+
+async def _tx_scan(page, first, stop, after, budget, deadline):
+    """Read activity pages from `first` on, newest first. Rows down to and including
+       `after` are already exported and skipped; the scan ends at `stop` (its id, or
+       anything older), at the end of the history, or when `budget` pages or the
+       deadline run out. Returns (new rows newest first, pages read, finished)."""
+    out, seen, passed = [], set(), after is None
+    for n in range(first, first + budget):
+        resp = await page.request.get(TX_API_URL.format(page=n, size=TX_PAGE_SIZE),
+                                      timeout=deadline.ms(30000))
+        if not resp.ok:
+            raise RuntimeError(f"activity page {n}: HTTP {resp.status}")
+        rows = _transactions_from_json(json.loads(await resp.text(), parse_float=Decimal))
+        count("tx_pages")
+        for r in rows:
+            if stop and (r["id"] == stop["id"] or r["ts"] < stop["ts"]):
+                return out, n - first + 1, True
+            if not passed:
+                if r["id"] == after["id"] or r["ts"] >= after["ts"]:
+                    passed = r["id"] == after["id"]
+                    continue
+                passed = True
+            if r["id"] not in seen:   # rows shift down a page when new ones arrive mid-export
+                seen.add(r["id"])
+                out.append(r)
+        if len(rows) < TX_PAGE_SIZE:
+            return out, n - first + 1, True
+        if deadline.expired():
+            return out, n - first + 1, False
+    return out, budget, False
 
-            dec_text = ""
-            dec_el = page.locator(BALANCE_SELECTOR_DEC).first
-            if await dec_el.count():
-                dec_text = (await dec_el.text_content() or "").strip()
+async def export_transactions(page, deadline=None) -> int:
+    """Page through TX_API_URL with the page's logged-in session, newest first, until
+       the cursor; steady-state runs stop on the first page. A run that hits
+       TX_MAX_PAGES or the deadline first records the unread stretch as a gap, and
+       later runs work through the gaps (oldest rows last) after their own head scan,
+       so a long backfill spreads over several runs without losing anything.
+       Returns the number of new rows."""
+    deadline = deadline or Deadline(RUN_BUDGET)
+    state = await asyncio.to_thread(tx_cursor) or {}
+    head = _tx_ref(state) if "id" in state else None
+    budget, new, gaps = TX_MAX_PAGES, [], []
 
-            balance_text = _normalize_amount(main_text + dec_text)
-        except PwTimeout:
+    rows, used, done = await _tx_scan(page, TX_FIRST_PAGE, head, None, budget, deadline)
+    budget -= used
+    new += rows
+    if rows and not done:
+        # Rows only move to later pages as transactions arrive, so the next unread
+        # one is on the following page or after it
+        gaps.append({"page": TX_FIRST_PAGE + used, "until": head, "after": _tx_ref(rows[-1])})
+    if rows:
+        state.update(_tx_ref(rows[0]))
+
+    for gap in state.get("gaps", []):
+        if budget <= 0 or deadline.expired():
+            gaps.append(gap)
+            continue
+        rows, used, done = await _tx_scan(page, gap["page"], gap["until"], gap["after"], budget, deadline)
+        budget -= used
+        new += rows
+        if not done:
+            gaps.append({"page": gap["page"] + used, "until": gap["until"],
+                         "after": _tx_ref(rows[-1]) if rows else gap["after"]})
+
+    if gaps:
+        print(f"[tx] backfill incomplete ({len(gaps)} gap(s)); the next run continues from there")
+    if new or gaps != state.get("gaps", []):
+        state["gaps"] = gaps
+        new.sort(key=lambda r: r["ts"])   # each write is oldest first
+        await asyncio.to_thread(_tx_store, new, state)
+    count("tx_new", len(new))
+    print(f"[tx] {len(new)} new transaction(s)")
+    return len(new)
+
+async def _export_transactions_quietly(page):
+    """The export never costs us the balance reading: failures are logged and retried
+       next run from the same cursor."""
+    try:
+        with span("tx_export"):
+            await export_transactions(page)
+    except Exception as e:
+        count("tx_export_failures")
+        print(f"[WARN] Transaction export failed: {e}")
+
+async def _fetch_balance(ready=None):
+    """Fetch every wallet with a fresh browser. `ready` is an awaitable (e.g. the
+       profile sync) that must finish before the browser opens USER_DATA_DIR; the
+       Playwright driver starts up in the meantime."""
+    async with _import("playwright.async_api").async_playwright() as p:
+        if ready is not None:
+            await ready
+        with span("browser_launch"):
+            browser, page = await _launch_context(p)
+        events = _trace_attach(page)
+        capture = _capture_balance_response(page) if BALANCE_SOURCE == "api" else None
+        try:
+            with span("goto"):
+                await page.goto(DASHBOARD_URL, wait_until="domcontentloaded")
+            wallets = await _extract_balance(page, capture=capture)
+            if TX_API_URL:
+                await _export_transactions_quietly(page)
+            return wallets
+        except Exception as e:
+            await _trace_dump(page, events, e)
+            raise
+        finally:
+            if capture is not None:
+                capture.cancel()   # detaches its listener if the flow failed before using it
+            if ROUTE_BLOCK:
+                blocked = _metrics["counters"].get("route_blocked", 0)
+                saved = _metrics["counters"].get("route_saved_bytes_est", 0)
+                print(f"[route] blocked {blocked} request(s), ~{saved / 1024:.0f} KiB saved (est.)")
+            g = _metrics["gauges"]
+            if "browser_peak_rss_bytes" in g:
+                print(f"[resources] browser peak {g['browser_peak_rss_bytes'] / 1048576:.0f} MiB, "
+                      f"cpu {g['browser_cpu_seconds']:.1f}s")
             await browser.close()
-            raise RuntimeError("Balance element not found; update BALANCE_SELECTOR_MAIN/_DEC")
 
-        # 4) Currency (best-effort)
-        currency_text = "USD"
+# --- Single flight: one fetch per profile at a time, its result shared for RESULT_TTL ---
+def _acquire_lock(path: Path, timeout: float):
+    """Exclusive lock on `path` (flock, or msvcrt on Windows); returns the open file
+       that holds it. Polls so it can give up after `timeout` seconds."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = open(path, "a+b")
+    end = time.monotonic() + timeout
+    waited = False
+    while True:
         try:
-            cur_el = page.locator(CURRENCY_SELECTOR).first
-            if await cur_el.count():
-                currency_text = (await cur_el.text_content() or "").strip() or "USD"
-        except Exception:
-            pass
+            if os.name == "nt":
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except OSError:
+            if time.monotonic() >= end:
+                f.close()
+                raise RuntimeError(f"{path} still held after {timeout:.0f}s; another fetch is stuck")
+            if not waited:
+                print("[single-flight] another fetch is running → waiting for it")
+                waited = True
+            time.sleep(0.2)
+
+def _release_lock(f):
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    f.close()
+
+@contextmanager
+def _profile_lock(timeout=None):
+    f = _acquire_lock(FETCH_LOCK, FETCH_LOCK_WAIT if timeout is None else timeout)
+    try:
+        yield
+    finally:
+        _release_lock(f)
+
+def _save_result(wallets):
+    tmp = FETCH_RESULT.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"ts": time.time(), "wallets": [[str(a), c] for a, c in wallets]}),
+                   encoding="utf-8")
+    os.replace(tmp, FETCH_RESULT)
+
+def _load_result():
+    """(finish time, wallets) of the last successful fetch, or (0, None)."""
+    try:
+        data = json.loads(FETCH_RESULT.read_text(encoding="utf-8"))
+        return data["ts"], [Wallet(Decimal(a), c) for a, c in data["wallets"]]
+    except (OSError, ValueError, KeyError, TypeError, InvalidOperation):
+        return 0.0, None
+
+async def fetch_shared(sync=False, fresh=False):
+    """_fetch_balance behind the host-wide profile lock. Returns (wallets, fetched):
+       within RESULT_TTL of the last successful fetch the cached wallets come back
+       without a browser, and a caller that had to wait for another process's fetch
+       takes its result. `sync` runs the host profile sync under the lock, overlapped
+       with driver start-up; `fresh` skips the TTL (a result fetched while waiting
+       is still shared)."""
+    since = time.time()
+    ttl = 0 if fresh else RESULT_TTL
+    ts, wallets = _load_result()
+    if wallets and ts > since - ttl:
+        count("fetch_cached")
+        print(f"[single-flight] reusing the balance fetched {since - ts:.0f}s ago")
+        return wallets, False
+    lock = await asyncio.to_thread(_acquire_lock, FETCH_LOCK, FETCH_LOCK_WAIT)
+    try:
+        ts, wallets = _load_result()
+        if wallets and ts > min(since, time.time() - ttl):
+            count("fetch_shared")
+            print("[single-flight] took the result of the fetch we waited for")
+            return wallets, False
+        ready = None
+        if sync:
+            ready = asyncio.ensure_future(asyncio.to_thread(_timed, "profile_sync", _sync_host_profile))
+        try:
+            with span("fetch"):
+                wallets = await _fetch_balance(ready=ready)
+        finally:
+            if ready is not None:
+                await asyncio.gather(ready, return_exceptions=True)
+        _save_result(wallets)
+        return wallets, True
+    finally:
+        _release_lock(lock)
+
+async def _healthy(browser, page) -> bool:
+    """Cheap liveness probe for the warm browser: page open and JS responding."""
+    try:
+        if page.is_closed() or page not in browser.pages:
+            return False
+        return await asyncio.wait_for(page.evaluate("1 + 1"), timeout=5) == 2
+    except Exception:
+        return False
+
+def _flush_logged():
+    """_flush_outbox for the daemon's background task: an error (e.g. a locked or
+       corrupt outbox) is logged and counted instead of being left on the task."""
+    try:
+        return _flush_outbox()
+    except Exception as e:
+        count("outbox_flush_errors")
+        print(f"[outbox] flush error: {e}")
+        return 0
+
+async def run_daemon(interval: float):
+    """Keep one persistent context warm and read the balance every `interval` seconds.
+       The browser is relaunched only when the health probe fails or ticks keep failing;
+       a failed launch is retried on a later tick, backing off up to 16 intervals.
+       Every DAEMON_UPDATE_EVERY ticks an update check runs alongside the tick; a found
+       update is installed between ticks, after the browser is closed."""
+    print(f"[daemon] starting, interval={interval:.0f}s")
+    async with _import("playwright.async_api").async_playwright() as p:
+        browser = page = flusher = update = None
+        failures = ticks = launch_failures = retry_tick = 0
+        next_tick = time.monotonic()
+        while True:
+            ticks += 1
+            if DAEMON_UPDATE_EVERY and ticks % DAEMON_UPDATE_EVERY == 0 and update is None:
+                update = asyncio.ensure_future(asyncio.to_thread(check_for_update))
+            if browser is None or failures >= DAEMON_MAX_FAILURES or not await _healthy(browser, page):
+                if browser is not None:
+                    print("[daemon] browser unhealthy → restarting")
+                    count("browser_restarts")
+                    try:
+                        await browser.close()
+                    except Exception:
+                        pass
+                browser = page = None
+                if ticks >= retry_tick:
+                    try:
+                        with span("browser_launch"):
+                            browser, page = await _launch_context(p)
+                        events = _trace_attach(page)
+                        warm, failures, launch_failures = False, 0, 0
+                    except Exception as e:
+                        launch_failures += 1
+                        count("browser_launch_failures")
+                        skip = min(2 ** (launch_failures - 1), 16)
+                        retry_tick = ticks + skip
+                        print(f"[daemon] browser launch failed ({launch_failures} in a row), "
+                              f"retrying in {skip} tick(s): {e}")
+            wallets = None
+            if page is not None:
+                events.clear()   # a trace should only show the tick that failed
+                t0 = time.monotonic()
+                capture = _capture_balance_response(page) if BALANCE_SOURCE == "api" else None
+                try:
+                    with span("goto"):
+                        await page.goto(DASHBOARD_URL, wait_until="domcontentloaded")
+                    wallets = await _extract_balance(page, warm=warm, capture=capture)
+                    warm, failures = True, 0
+                    if TX_API_URL:
+                        await _export_transactions_quietly(page)
+                    print(f"[daemon] tick ok in {time.monotonic() - t0:.1f}s")
+                except Exception as e:
+                    failures += 1
+                    warm = False
+                    print(f"[daemon] tick failed ({failures}/{DAEMON_MAX_FAILURES}): {e}")
+                    await _trace_dump(page, events, e)
+                finally:
+                    if capture is not None:
+                        # A tick that failed before the extraction used it would otherwise
+                        # leave its response listener on the warm page
+                        capture.cancel()
+            if wallets:
+                await asyncio.to_thread(_save_result, wallets)
+            if wallets and await asyncio.to_thread(_record_reading, wallets):
+                await asyncio.to_thread(_enqueue_reading, *wallets[0])
+            await asyncio.to_thread(write_metrics, bool(wallets))
+            _reset_metrics()
+            # Flush in the background so a slow web app never delays the next tick
+            if flusher is None or flusher.done():
+                flusher = asyncio.create_task(asyncio.to_thread(_flush_logged))
+
+            if update is not None and update.done():
+                staged = update.result()
+                update = None
+                if staged:
+                    print("[daemon] update ready → closing browser and restarting")
+                    if browser is not None:
+                        await browser.close()
+                    await flusher
+                    apply_update(staged)   # execs into the new version; returns only on rollback
+
+            # Fixed-rate schedule; if a tick overran, skip the missed slots instead of bunching up
+            next_tick += interval
+            now = time.monotonic()
+            if next_tick < now:
+                next_tick = now + interval - ((now - next_tick) % interval)
+            await asyncio.sleep(next_tick - now)
 
-        await browser.close()
-        return balance_text, currency_text
+def _outbox_conn():
+    conn = sqlite3.connect(OUTBOX_DB, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS outbox (
+        id        INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts        TEXT NOT NULL,
+        vps       TEXT,
+        balance   TEXT NOT NULL,
+        currency  TEXT NOT NULL,
+        attempts  INTEGER NOT NULL DEFAULT 0,
+        next_try  REAL NOT NULL DEFAULT 0
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS tx_outbox (
+        id        INTEGER PRIMARY KEY AUTOINCREMENT,
+        tx_id     TEXT NOT NULL UNIQUE,
+        doc       TEXT NOT NULL,
+        attempts  INTEGER NOT NULL DEFAULT 0,
+        next_try  REAL NOT NULL DEFAULT 0
+    )""")
+    conn.execute("CREATE TABLE IF NOT EXISTS outbox_meta (k TEXT PRIMARY KEY, v TEXT)")
+    return conn
 
-def _push_to_sheet(balance, currency):
+def _enqueue_reading(balance, currency):
+    """Durably record one reading; the network write happens later in _flush_outbox."""
+    with closing(_outbox_conn()) as conn, conn:
+        conn.execute(
+            "INSERT INTO outbox (ts, vps, balance, currency) VALUES (?, ?, ?, ?)",
+            (datetime.now().isoformat(timespec="seconds"), VPS, str(balance), str(currency)),
+        )
+
+def _batching() -> bool:
+    # The collector always takes arrays; the web app only when WEBAPP_BATCH says so
+    return WEBAPP_BATCH or bool(COLLECTOR_URL)
+
+def _post_rows(rows):
+    """Send (id, ts, vps, balance, currency) rows to the collector or web app in a single POST."""
+    docs = [{"neteller": bal + cur, "vps": vps, "ts": ts} for _, ts, vps, bal, cur in rows]
+    if COLLECTOR_URL:
+        headers = {"Authorization": f"Bearer {COLLECTOR_TOKEN}"} if COLLECTOR_TOKEN else {}
+        r = _session().post(COLLECTOR_URL, data=json.dumps(docs), headers=headers, timeout=25)
+        r.raise_for_status()
+        return
     if not WEBAPP_URL or not WEBAPP_TOKEN:
         raise RuntimeError("WEBAPP_URL/WEBAPP_TOKEN not configured")
-    payload = {"neteller": str(balance)+str(currency), "vps": VPS}
-    json_data = json.dumps(payload)
-    r = requests.post(WEBAPP_URL, data=json_data, timeout=25)
+    r = _session().post(WEBAPP_URL, data=json.dumps(docs if WEBAPP_BATCH else docs[0]), timeout=25)
     r.raise_for_status()
-    print(f"[OK] {datetime.now().isoformat(timespec='seconds')} -> {balance} {currency}")
 
-if __name__ == "__main__":
-    maybe_self_update()
+def _post_tx_docs(docs):
+    headers = {"Authorization": f"Bearer {TX_PUSH_TOKEN}"} if TX_PUSH_TOKEN else {}
+    r = _session().post(TX_PUSH_URL, data=json.dumps(docs), headers=headers, timeout=25)
+    r.raise_for_status()
+
+def _flush_tx_outbox(conn) -> int:
+    """Send queued transactions in batches, oldest first, to TX_PUSH_URL. Neither the
+       balance web app nor the collector (newest document per VPS) can take them, so
+       without TX_PUSH_URL nothing is queued or sent. Same backoff as readings;
+       returns the number sent."""
+    sent = 0
+    while TX_PUSH_URL:
+        rows = conn.execute(
+            "SELECT id, doc FROM tx_outbox WHERE next_try <= ? ORDER BY id LIMIT ?",
+            (time.time(), OUTBOX_BATCH_SIZE),
+        ).fetchall()
+        if not rows:
+            break
+        try:
+            _post_tx_docs([json.loads(doc) for _, doc in rows])
+        except Exception as e:
+            with conn:
+                conn.executemany(
+                    "UPDATE tx_outbox SET attempts = attempts + 1, "
+                    "next_try = ? + min(?, ? * (1 << min(attempts, 16))) WHERE id = ?",
+                    [(time.time(), OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE, r[0]) for r in rows],
+                )
+            print(f"[outbox] transaction flush failed, {len(rows)} backed off: {e}")
+            break
+        with conn:
+            conn.executemany("DELETE FROM tx_outbox WHERE id = ?", [(r[0],) for r in rows])
+        sent += len(rows)
+    return sent
+
+def _flush_outbox():
+    """Send pending rows in batches, oldest first. On failure the remaining rows are
+       backed off exponentially and left in place, so nothing is lost while the web
+       app is down. Returns the number of rows sent."""
+    t0 = time.monotonic()
+    sent = 0
+    with closing(_outbox_conn()) as conn:
+        failed = False
+        while not failed:
+            rows = conn.execute(
+                "SELECT id, ts, vps, balance, currency FROM outbox WHERE next_try <= ? ORDER BY id LIMIT ?",
+                (time.time(), OUTBOX_BATCH_SIZE),
+            ).fetchall()
+            if not rows:
+                break
+            # Without batching the web app takes one document per request; the
+            # keep-alive session still saves the handshake for every row after the first
+            chunks = [rows] if _batching() else [[r] for r in rows]
+            for n, chunk in enumerate(chunks):
+                ids = [(r[0],) for r in chunk]
+                try:
+                    _post_rows(chunk)
+                except Exception as e:
+                    pending = [(r[0],) for c in chunks[n:] for r in c]
+                    with conn:
+                        conn.executemany(
+                            "UPDATE outbox SET attempts = attempts + 1, "
+                            "next_try = ? + min(?, ? * (1 << min(attempts, 16))) WHERE id = ?",
+                            [(time.time(), OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE, i) for (i,) in pending],
+                        )
+                    print(f"[outbox] flush failed, {len(pending)} row(s) backed off: {e}")
+                    failed = True
+                    break
+                with conn:
+                    conn.executemany("DELETE FROM outbox WHERE id = ?", ids)
+                sent += len(chunk)
+                for _, ts, _, bal, cur in chunk:
+                    print(f"[OK] {ts} -> {bal} {cur}")
+        tx_sent = _flush_tx_outbox(conn)
+        elapsed = time.monotonic() - t0
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO outbox_meta VALUES ('last_flush_s', ?)", (f"{elapsed:.3f}",))
+            conn.execute("INSERT OR REPLACE INTO outbox_meta VALUES ('last_flush_at', ?)", (f"{time.time():.0f}",))
+    stats = outbox_stats()
+    print(f"[outbox] sent {sent}, pending {stats['depth']}, transactions sent {tx_sent}, "
+          f"pending {stats['tx_depth']}, flush {elapsed:.2f}s")
+    return sent
+
+def outbox_stats() -> dict:
+    """Queue depths, age of the oldest pending reading and the last flush latency."""
+    with closing(_outbox_conn()) as conn:
+        depth, oldest = conn.execute("SELECT count(*), min(ts) FROM outbox").fetchone()
+        tx_depth, = conn.execute("SELECT count(*) FROM tx_outbox").fetchone()
+        meta = dict(conn.execute("SELECT k, v FROM outbox_meta").fetchall())
+    return {
+        "depth": depth,
+        "oldest": oldest,
+        "tx_depth": tx_depth,
+        "last_flush_s": float(meta["last_flush_s"]) if "last_flush_s" in meta else None,
+        "last_flush_at": int(meta["last_flush_at"]) if "last_flush_at" in meta else None,
+    }
+
+# --- Collector: many VPS clients in, one deduplicated forward per interval out ---
+def _load_collector_state() -> dict:
+    try:
+        with open(COLLECTOR_STATE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_collector_state(pending: dict):
+    d = os.path.dirname(os.path.abspath(COLLECTOR_STATE))
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=".collector_", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(pending, f)
+    os.replace(tmp, COLLECTOR_STATE)
+
+def _forward_body(body):
+    """One POST to the web app: an array of documents (WEBAPP_BATCH) or a single one."""
+    if not WEBAPP_URL or not WEBAPP_TOKEN:
+        raise RuntimeError("WEBAPP_URL/WEBAPP_TOKEN not configured")
+    r = _session().post(WEBAPP_URL, data=json.dumps(body), timeout=25)
+    r.raise_for_status()
+
+def run_collector(bind=None, port=None, interval=None):
+    """Accept {"neteller", "vps"} documents (single or arrays) over HTTP, keep only the
+       newest per VPS, and forward what is pending once per interval: one batched write
+       with WEBAPP_BATCH=1, otherwise one POST per VPS. Pending documents are persisted
+       and each is dropped as soon as its POST succeeds, so a restart or a web app
+       outage loses nothing and a failure part-way through resends nothing twice."""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    bind, port = bind or COLLECTOR_BIND, port or COLLECTOR_PORT
+    interval = interval or COLLECTOR_INTERVAL
+    lock = threading.Lock()
+    pending = _load_collector_state()
+    stats = {"accepted": 0, "forwarded": 0, "last_forward": None, "last_error": None}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *a):
+            pass
+
+        def _reply(self, code, obj):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with lock:
+                self._reply(200, {"pending": len(pending), **stats})
+
+        def do_POST(self):
+            if COLLECTOR_TOKEN and self.headers.get("Authorization") != f"Bearer {COLLECTOR_TOKEN}":
+                return self._reply(401, {"error": "unauthorized"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+            except ValueError:
+                return self._reply(400, {"error": "invalid JSON"})
+            docs = body if isinstance(body, list) else [body]
+            if not all(isinstance(d, dict) and isinstance(d.get("neteller"), str) for d in docs):
+                return self._reply(400, {"error": "expected {\"neteller\", \"vps\"} documents"})
+            with lock:
+                for d in docs:
+                    key = str(d.get("vps") or self.client_address[0])
+                    prev = pending.get(key)
+                    if prev is None or str(d.get("ts") or "") >= str(prev.get("ts") or ""):
+                        pending[key] = d
+                stats["accepted"] += len(docs)
+                _save_collector_state(pending)
+            self._reply(200, {"ok": True, "accepted": len(docs)})
+
+    srv = ThreadingHTTPServer((bind, port), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    print(f"[collector] listening on {bind}:{port}, forwarding every {interval:.0f}s")
+    try:
+        while True:
+            time.sleep(interval)
+            with lock:
+                batch = dict(pending)
+            if not batch:
+                continue
+            t0 = time.monotonic()
+            items = list(batch.items())
+            chunks = [items] if WEBAPP_BATCH else [[kv] for kv in items]
+            sent = 0
+            for chunk in chunks:
+                try:
+                    _forward_body([doc for _, doc in chunk] if WEBAPP_BATCH else chunk[0][1])
+                except Exception as e:
+                    stats["last_error"] = str(e)
+                    print(f"[collector] forward failed, {len(batch) - sent} kept: {e}")
+                    break
+                with lock:
+                    # Drop what was sent unless a newer document arrived meanwhile
+                    for key, doc in chunk:
+                        if pending.get(key) is doc:
+                            del pending[key]
+                    _save_collector_state(pending)
+                    stats["forwarded"] += len(chunk)
+                    stats["last_forward"] = datetime.now().isoformat(timespec="seconds")
+                sent += len(chunk)
+            else:
+                stats["last_error"] = None
+            if sent:
+                print(f"[collector] forwarded {sent} VPS reading(s) in {time.monotonic() - t0:.2f}s")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.shutdown()
+
+# --- Local balance history: fixed-width, append-only, sorted by time ---
+# <q ts (epoch seconds)> <q balance * HISTORY_SCALE> <8s currency> <24s vps>
+_HIST = struct.Struct("<qq8s24s")
+HISTORY_SCALE = 10_000
+
+HistoryRow = namedtuple("HistoryRow", "ts balance currency vps")
+
+def _hist_unpack(buf: bytes) -> HistoryRow:
+    ts, amt, cur, vps = _HIST.unpack(buf)
+    return HistoryRow(ts, Decimal(amt) / HISTORY_SCALE,
+                      cur.rstrip(b"\0").decode("utf-8", "replace"),
+                      vps.rstrip(b"\0").decode("utf-8", "replace"))
+
+def history_append(balance, currency, ts=None):
+    amt = int((Decimal(str(balance)) * HISTORY_SCALE).to_integral_value())
+    rec = _HIST.pack(int(ts if ts is not None else time.time()), amt,
+                     str(currency).encode("utf-8")[:8], str(VPS or "").encode("utf-8")[:24])
+    with open(HISTORY_FILE, "ab") as f:
+        # Drop a torn trailing record left by a crash mid-write
+        extra = f.tell() % _HIST.size
+        if extra:
+            f.truncate(f.tell() - extra)
+        f.write(rec)
+
+def _history_count(f) -> int:
+    f.seek(0, os.SEEK_END)
+    return f.tell() // _HIST.size
+
+def _history_at(f, i) -> HistoryRow:
+    f.seek(i * _HIST.size)
+    return _hist_unpack(f.read(_HIST.size))
+
+def history_latest(currency=None):
+    """Most recent row (for `currency`, if given), or None. Reads backwards from the end."""
+    try:
+        with open(HISTORY_FILE, "rb") as f:
+            for i in range(_history_count(f) - 1, -1, -1):
+                row = _history_at(f, i)
+                if currency is None or row.currency == currency:
+                    return row
+    except FileNotFoundError:
+        pass
+    return None
+
+def history_range(start=None, end=None, currency=None):
+    """Rows with start <= ts < end (epoch seconds), located by binary search."""
+    try:
+        f = open(HISTORY_FILE, "rb")
+    except FileNotFoundError:
+        return []
+    with f:
+        n = _history_count(f)
+        lo, hi = 0, n
+        if start is not None:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if _history_at(f, mid).ts < start:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        f.seek(lo * _HIST.size)
+        out = []
+        for _ in range(lo, n):
+            row = _hist_unpack(f.read(_HIST.size))
+            if end is not None and row.ts >= end:
+                break
+            if currency is None or row.currency == currency:
+                out.append(row)
+        return out
+
+def history_deltas(start=None, end=None, currency=None):
+    """(ts, change since previous reading) for each reading of one wallet whose value
+       moved. Defaults to the currency of the latest reading."""
+    if currency is None:
+        latest = history_latest()
+        currency = latest.currency if latest else None
+    rows = history_range(start, end, currency)
+    return [(b.ts, b.balance - a.balance) for a, b in zip(rows, rows[1:]) if b.balance != a.balance]
+
+def _record_reading(wallets) -> bool:
+    """Append every wallet to local history; return True if the primary (first) one
+       should be published. With PUSH_MODE=changed only a new value or an expired
+       heartbeat is published."""
+    now = time.time()
+    # Primary wallet last, so history_latest() without a currency returns it
+    for amount, cur in reversed(wallets):
+        try:
+            history_append(amount, cur, ts=now)
+        except (InvalidOperation, OSError) as e:
+            print(f"[history] not recorded ({amount!r}): {e}")
+    balance, currency = wallets[0]
+    if PUSH_MODE != "changed":
+        return True
+    value = f"{balance}{currency}"
+    with closing(_outbox_conn()) as conn, conn:
+        meta = dict(conn.execute(
+            "SELECT k, v FROM outbox_meta WHERE k IN ('last_pushed_value', 'last_pushed_at')").fetchall())
+        due = time.time() - float(meta.get("last_pushed_at", 0)) >= PUSH_HEARTBEAT
+        if meta.get("last_pushed_value") == value and not due:
+            print(f"[history] unchanged ({balance} {currency}); push skipped")
+            return False
+        # Recorded at enqueue time: the outbox keeps the row until it is delivered,
+        # and every run flushes it, so a failed push is retried without a new value
+        conn.execute("INSERT OR REPLACE INTO outbox_meta VALUES ('last_pushed_value', ?)", (value,))
+        conn.execute("INSERT OR REPLACE INTO outbox_meta VALUES ('last_pushed_at', ?)", (f"{time.time():.0f}",))
+    return True
+
+def _cmd_update(args):
+    with span("self_update"):
+        maybe_self_update()
+
+def _cmd_sync(args):
+    Path(USER_DATA_DIR).mkdir(parents=True, exist_ok=True)
+    with _profile_lock(), span("profile_sync"):
+        _sync_host_profile()
+
+def _cmd_fetch(args):
+    """Fetch, record and queue; the network write is left to `push` unless asked.
+       A balance shared from another process's fetch was already recorded there."""
+    Path(USER_DATA_DIR).mkdir(parents=True, exist_ok=True)
+    wallets, fetched = asyncio.run(fetch_shared(fresh=args.fresh))
+    for amount, currency in wallets:
+        print(f"[INFO] {amount} {currency}")
+    if fetched and _record_reading(wallets):
+        _enqueue_reading(*wallets[0])
+    if args.push:
+        with span("push"):
+            _flush_outbox()
+
+def _cmd_push(args):
+    with span("push"):
+        _flush_outbox()
+
+def _cmd_status(args):
+    stats = outbox_stats()
+    sha, _ = _read_update_cache()
+    latest = history_latest()
+    print(f"version     {sha or 'unknown'}")
+    print(f"outbox      {stats['depth']} pending, oldest {stats['oldest'] or '-'}, "
+          f"last flush {stats['last_flush_s'] if stats['last_flush_s'] is not None else '-'}s")
+    if latest:
+        print(f"latest      {latest.balance} {latest.currency} at "
+              f"{datetime.fromtimestamp(latest.ts).isoformat(timespec='seconds')}")
+    else:
+        print("latest      -")
+    cursor = tx_cursor() or {}
+    print(f"tx cursor   {cursor['id'] + ' at ' + cursor['ts'] if 'id' in cursor else '-'}, "
+          f"{len(cursor.get('gaps', []))} backfill gap(s), {stats['tx_depth']} pending push")
+
+def _cmd_maintain(args):
+    async def launch_time():
+        async with _import("playwright.async_api").async_playwright() as p:
+            t0 = time.perf_counter()
+            browser, _ = await _launch_context(p)
+            secs = time.perf_counter() - t0
+            await browser.close()
+            return secs
+
+    # SingletonLock alone misses a run whose Chromium is still starting up
+    with _profile_lock():
+        if args.measure_launch:
+            print(f"[maintain] launch before: {asyncio.run(launch_time()):.2f}s")
+        ok = maintain_profile(args.budget_mb)
+        if args.measure_launch and ok:
+            print(f"[maintain] launch after: {asyncio.run(launch_time()):.2f}s")
+
+def _cmd_collect(args):
+    run_collector(args.bind, args.port, args.interval)
+
+def _timed(name, fn, *a):
+    with span(name):
+        return fn(*a)
+
+async def run_pipeline():
+    """update, sync, fetch and push with independent stages overlapped: the update
+       check runs next to everything else, the profile sync next to driver start-up,
+       and blocking I/O stays off the event loop. An update found along the way is
+       only installed after the push, for the next run. Sync and fetch go through
+       fetch_shared, so concurrent runs share one browser's result."""
+    Path(USER_DATA_DIR).mkdir(parents=True, exist_ok=True)
+    update = asyncio.ensure_future(asyncio.to_thread(_timed, "self_update", check_for_update))
+    try:
+        wallets, fetched = await fetch_shared(sync=True)
+        for amount, currency in wallets:
+            print(f"[INFO] {amount} {currency}")
+        # A shared result was recorded and queued by the run that fetched it
+        if fetched and await asyncio.to_thread(_record_reading, wallets):
+            await asyncio.to_thread(_enqueue_reading, *wallets[0])
+        # Flush on every run, so rows backed off earlier (and new transactions)
+        # never wait for the balance to change
+        with span("push"):
+            await asyncio.to_thread(_flush_outbox)
+    finally:
+        staged = await update
+        if staged:
+            apply_update(staged, restart=False)
+
+def _cmd_run(args):
+    """The classic pipeline: update, sync, fetch, push (overlapped, see run_pipeline)."""
+    asyncio.run(run_pipeline())
+
+def _cmd_daemon(args):
+    """The daemon holds the profile lock for its lifetime; one-shot runs meanwhile
+       get its latest result from FETCH_RESULT (keep RESULT_TTL above the interval)."""
+    _cmd_update(args)
     Path(USER_DATA_DIR).mkdir(parents=True, exist_ok=True)
-    _copy_host_profile_once()
-    bal, cur = asyncio.run(_fetch_balance())
-    _push_to_sheet(bal, cur)
+    with _profile_lock():
+        with span("profile_sync"):
+            _sync_host_profile()
+        asyncio.run(run_daemon(args.interval))
+
+# Where earlier versions kept each state file: the working directory
+LEGACY_STATE = {OUTBOX_DB: "outbox.sqlite3", HISTORY_FILE: "balance_history.bin",
+                TX_FILE: "transactions.jsonl", TX_CURSOR: ".tx_cursor.json"}
+
+def _migrate_state():
+    """Create STATE_DIR and move in state files an earlier version left in the working
+       directory, so pending pushes and history survive the upgrade."""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    for target, legacy in LEGACY_STATE.items():
+        if os.path.exists(target) or not os.path.isfile(legacy) \
+                or os.path.abspath(legacy) == os.path.abspath(target):
+            continue
+        for suffix in ("", "-wal", "-shm"):   # SQLite sidecars travel with the database
+            if os.path.exists(legacy + suffix):
+                shutil.move(legacy + suffix, target + suffix)
+        print(f"[startup] moved {legacy} to {target}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="main.py", description="Neteller balance -> sheet")
+    ap.add_argument("--timings", action="store_true", help="print the import-time report on exit")
+    sub = ap.add_subparsers(dest="cmd")
+    sub.add_parser("run", help="update, sync, fetch and push (default)")
+    sub.add_parser("update", help="self-update from GitHub")
+    sub.add_parser("sync", help="delta-sync the host Chrome profile")
+    p = sub.add_parser("fetch", help="read the balance and queue it")
+    p.add_argument("--push", action="store_true", help="flush the outbox right away")
+    p.add_argument("--fresh", action="store_true", help="ignore a cached result younger than RESULT_TTL")
+    sub.add_parser("push", help="flush queued readings to the sheet")
+    sub.add_parser("status", help="outbox depth, latest reading and version")
+    p = sub.add_parser("maintain", help="prune caches and vacuum databases in USER_DATA_DIR")
+    p.add_argument("--budget-mb", type=float, default=None,
+                   help="only act when the profile is larger than this (default: always)")
+    p.add_argument("--measure-launch", action="store_true", help="time a browser launch before and after")
+    p = sub.add_parser("collect", help="run the fleet collector in front of the web app")
+    p.add_argument("--bind", default=COLLECTOR_BIND)
+    p.add_argument("--port", type=int, default=COLLECTOR_PORT)
+    p.add_argument("--interval", type=float, default=COLLECTOR_INTERVAL, help="seconds between forwards")
+    p = sub.add_parser("daemon", help="keep a warm browser and fetch on an interval")
+    p.add_argument("--interval", type=float, default=DAEMON_INTERVAL or 300)
+    args = ap.parse_args(argv)
+
+    cmd = args.cmd or ("daemon" if DAEMON_INTERVAL > 0 else "run")
+    _migrate_state()
+    if cmd == "daemon" and not hasattr(args, "interval"):
+        args.interval = DAEMON_INTERVAL
+    handler = globals()[f"_cmd_{cmd}"]
+    ok = False
+    try:
+        handler(args)
+        ok = True
+    finally:
+        if cmd in ("run", "fetch"):
+            write_metrics(ok)
+        if args.timings:
+            _import_report()
+
+_MODULE_LOAD_S = time.perf_counter() - _T_START
+
+if __name__ == "__main__":
+    main()
@@ -156,7 +156,7 @@ function Setup-Deps {
     & $UvExe pip install -r $Requirements -p $PyExe
   } else {
     Write-Warn "requirements.txt not found; installing minimal set."
-    & $UvExe pip install playwright python-dotenv requests assemblyai -p $PyExe
+    & $UvExe pip install playwright python-dotenv requests assemblyai psutil -p $PyExe
   }
 
   & $UvExe run --python $PyExe python -m playwright install
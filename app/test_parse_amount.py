@@ -0,0 +1,36 @@
+"""Amount parsing regressions (both of these once misread silently).
+
+    python -m pytest app/test_parse_amount.py
+"""
+from decimal import Decimal
+
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def infer_separator(monkeypatch):
+    monkeypatch.setattr(main, "AMOUNT_DECIMAL_SEP", "")
+
+
+@pytest.mark.parametrize("whole, frac, expected", [
+    ("0.500", "", "0.500"),          # not a grouped 500
+    ("1.234,56", "", "1234.56"),
+    ("1,234", ".56", "1234.56"),     # split DOM rendering
+    ("(1,234)", "", "-1234"),        # accounting negative
+    ("1.234", ",56", "1234.56"),
+    ("12,5", "", "12.5"),
+])
+def test_parse_amount(whole, frac, expected):
+    assert main._parse_amount(whole, frac) == Decimal(expected)
+
+
+def test_wallets_from_json_parses_formatted_strings():
+    data = {"wallets": [
+        {"balance": "1.234,56", "currency": "EUR"},
+        {"balance": "0.500", "currency": "GBP"},
+        {"balance": Decimal("12.5"), "currency": "USD"},
+    ]}
+    assert main._wallets_from_json(data) == [
+        (Decimal("1234.56"), "EUR"), (Decimal("0.500"), "GBP"), (Decimal("12.5"), "USD")]
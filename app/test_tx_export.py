@@ -0,0 +1,120 @@
+"""Transaction export against a stubbed activity endpoint (no browser needed).
+
+    python -m pytest app/test_tx_export.py
+"""
+import asyncio, json
+
+import pytest
+
+import main
+
+
+class _Resp:
+    def __init__(self, body):
+        self.ok, self.status, self._body = True, 200, body
+
+    async def text(self):
+        return self._body
+
+
+class _Activity:
+    """page.request stand-in serving the activity newest first, TX_PAGE_SIZE per page."""
+    def __init__(self, n):
+        self.txs = []
+        self.add(n)
+        self.request = self
+        self.calls = 0
+
+    def add(self, n):
+        start = len(self.txs)
+        self.txs += [{"transactionId": f"t{i}", "transactionDate": 1790000000 + i * 60,
+                      "amount": f"{i}.00", "currency": "EUR"} for i in range(start, start + n)]
+
+    async def get(self, url, timeout=None):
+        self.calls += 1
+        n = int(url.split("page=")[1].split("&")[0])
+        size = main.TX_PAGE_SIZE
+        newest = self.txs[::-1]
+        return _Resp(json.dumps({"content": newest[(n - 1) * size:n * size]}))
+
+
+@pytest.fixture
+def tx_env(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TX_API_URL", "http://stub/activity?page={page}&size={size}")
+    monkeypatch.setattr(main, "TX_FIRST_PAGE", 1)
+    monkeypatch.setattr(main, "TX_PAGE_SIZE", 2)
+    monkeypatch.setattr(main, "TX_MAX_PAGES", 2)
+    monkeypatch.setattr(main, "TX_FILE", str(tmp_path / "transactions.jsonl"))
+    monkeypatch.setattr(main, "TX_CURSOR", str(tmp_path / ".tx_cursor.json"))
+    monkeypatch.setattr(main, "TX_PUSH_URL", "http://stub/transactions")
+    monkeypatch.setattr(main, "OUTBOX_DB", str(tmp_path / "outbox.sqlite3"))
+    return tmp_path
+
+
+def _exported():
+    with open(main.TX_FILE, encoding="utf-8") as f:
+        return [json.loads(line)["id"] for line in f]
+
+
+def _run(page):
+    return asyncio.run(main.export_transactions(page))
+
+
+def test_capped_backfill_resumes_until_complete(tx_env):
+    page = _Activity(10)
+    assert _run(page) == 4                      # t9..t6, then the page cap
+    assert main.tx_cursor()["gaps"]
+    while main.tx_cursor()["gaps"]:
+        _run(page)
+    assert sorted(_exported(), key=lambda i: int(i[1:])) == [f"t{i}" for i in range(10)]
+    assert main.tx_cursor()["id"] == "t9"
+
+
+def test_new_transactions_during_backfill_are_not_lost(tx_env):
+    page = _Activity(10)
+    _run(page)
+    page.add(3)                                 # arrive between runs, pushing old rows down
+    for _ in range(10):
+        _run(page)
+        page.add(1)
+    _run(page)
+    while main.tx_cursor()["gaps"]:
+        _run(page)
+    ids = _exported()
+    assert len(ids) == len(set(ids))
+    assert set(ids) == {t["transactionId"] for t in page.txs}
+
+
+def test_steady_state_reads_one_page(tx_env):
+    page = _Activity(3)
+    while _run(page) or main.tx_cursor()["gaps"]:
+        pass
+    page.add(1)
+    page.calls = 0
+    assert _run(page) == 1
+    assert page.calls == 1
+
+
+def test_uncommitted_write_is_cut_before_the_retry(tx_env):
+    page = _Activity(2)
+    _run(page)
+    with open(main.TX_FILE, "a", encoding="utf-8") as f:   # a write whose cursor never landed
+        f.write('{"id": "t1", "ts": "x"}\n{"id": "t2", "ts"')
+    page.add(1)
+    _run(page)
+    assert _exported() == ["t0", "t1", "t2"]
+
+
+def test_nothing_is_queued_without_a_push_url(tx_env, monkeypatch):
+    monkeypatch.setattr(main, "TX_PUSH_URL", "")
+    _run(_Activity(1))
+    assert _exported() == ["t0"]
+    assert main.outbox_stats()["tx_depth"] == 0
+
+
+def test_formatted_amounts_keep_their_decimals():
+    rows = main._transactions_from_json([
+        {"transactionId": "a", "transactionDate": 1790000000, "amount": "1.234,56", "currency": "EUR"},
+        {"transactionId": "b", "transactionDate": 1790000000, "amount": "-12.5", "currency": "EUR"},
+    ])
+    assert [r["amount"] for r in rows] == ["1234.56", "-12.5"]